@@ -0,0 +1,287 @@
+"""
+Нагрузочный бенчмарк обработчиков бота без обращения к Telegram.
+
+Приложение собирается через main.build_application с теми же обработчиками,
+что и в боевом режиме, но сетевой слой заменен заглушкой StubRequest:
+она отвечает на вызовы Bot API (getChatAdministrators, deleteMessage,
+restrictChatMember, sendMessage и т.д.) с заданной задержкой.
+Через приложение прогоняется поток обновлений - синтетический или
+записанный (JSON Lines, по одному Update на строку, как в getUpdates).
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_handlers --updates 20000 --latency-ms 50
+    python -m benchmarks.bench_handlers --replay updates.jsonl
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Iterator, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Состояние бенчмарка не должно попадать в рабочую базу
+os.environ.setdefault('BOT_DB_PATH', ':memory:')
+# и не должно занимать порт метрик или следить за файлами работающего бота
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('WORDS_WATCH', '0')
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder  # noqa: E402
+from telegram.request import BaseRequest, RequestData  # noqa: E402
+
+import config  # noqa: E402
+import main  # noqa: E402
+
+BOT_ID = 1000
+OWNER_ID = 1
+BOT_USER = {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+
+
+def _user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+
+class StubRequest(BaseRequest):
+    """Заглушка сетевого слоя: отвечает на вызовы Bot API локально с задержкой latency."""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_id = 10 ** 9
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        params = request_data.parameters if request_data else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        body = json.dumps({'ok': True, 'result': self._result(endpoint, params)})
+        return 200, body.encode()
+
+    def _result(self, endpoint: str, params: dict):
+        chat_id = params.get('chat_id', 0)
+        if endpoint == 'getMe':
+            return {**BOT_USER, 'can_join_groups': True, 'can_read_all_group_messages': True,
+                    'supports_inline_queries': False}
+        if endpoint == 'getChatAdministrators':
+            return [
+                {'status': 'creator', 'user': _user(OWNER_ID), 'is_anonymous': False},
+                {'status': 'administrator', 'user': BOT_USER, 'can_be_edited': False,
+                 'is_anonymous': False, 'can_manage_chat': True, 'can_delete_messages': True,
+                 'can_manage_video_chats': True, 'can_restrict_members': True,
+                 'can_promote_members': False, 'can_change_info': True, 'can_invite_users': True,
+                 'can_post_stories': False, 'can_edit_stories': False, 'can_delete_stories': False},
+            ]
+        if endpoint == 'getChatMember':
+            user_id = params.get('user_id', 0)
+            status = 'creator' if user_id == OWNER_ID else 'member'
+            return {'status': status, 'user': _user(user_id), 'is_anonymous': False}
+        if endpoint == 'sendMessage':
+            self._message_id += 1
+            return {'message_id': self._message_id, 'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'bench'},
+                    'from': BOT_USER, 'text': params.get('text', '')}
+        # deleteMessage(s), restrictChatMember, setChatPermissions, banChatMember, ...
+        return True
+
+
+# Словарь для обычных сообщений: тексты у разных пользователей должны различаться,
+# иначе поиск рейдов (services.duplicates) примет весь поток за один рейд
+CHATTER = (
+    'привет всем кто сегодня идет на встречу спасибо помогло а во сколько начало посмотрите '
+    'вложение выше ок договорились завтра утром вечером после работы я буду немного позже '
+    'можно ссылку на документ у меня не открывается проверьте пожалуйста почту кажется '
+    'все уже готово давайте обсудим в пятницу отличная идея согласен не уверен что успею '
+    'где найти расписание новый релиз вышел обновите приложение скиньте фото с вечера'
+).split()
+
+
+def _chatter(rng: random.Random) -> str:
+    return ' '.join(rng.choices(CHATTER, k=rng.randint(2, 9)))
+
+
+def synthetic_updates(count: int, chats: int, users: int, seed: int) -> Iterator[dict]:
+    """
+    Поток обновлений, похожий на обычный трафик групп: в основном чистый текст,
+    немного стоп-слов, ссылок, пересылок, входов участников и всплески флуда.
+    """
+    rng = random.Random(seed)
+    words = sorted(config.policies.base_words)
+    now = int(time.time())
+    flooder = None
+    for update_id in range(1, count + 1):
+        chat_id = -1000000000000 - rng.randrange(chats)
+        if flooder and rng.random() < 0.8:
+            chat_id, user_id = flooder
+        else:
+            user_id = 10_000 + rng.randrange(users)
+            flooder = (chat_id, user_id) if rng.random() < 0.01 else None
+
+        message = {
+            'message_id': update_id, 'date': now,
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'bench'},
+            'from': _user(user_id),
+        }
+        kind = rng.random()
+        if kind < 0.05 and words:
+            message['text'] = f"{_chatter(rng)} {rng.choice(words)}"
+        elif kind < 0.10:
+            message['text'] = 'заходите https://example.com/promo'
+            message['entities'] = [{'type': 'url', 'offset': 10, 'length': 25}]
+        elif kind < 0.13:
+            message['text'] = _chatter(rng)
+            message['forward_origin'] = {'type': 'user', 'date': now, 'sender_user': _user(user_id + 1)}
+        elif kind < 0.15:
+            message['new_chat_members'] = [_user(500_000 + update_id)]
+        else:
+            message['text'] = _chatter(rng)
+        yield {'update_id': update_id, 'message': message}
+
+
+def recorded_updates(path: str) -> Iterator[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def instrument(application, latencies: dict, in_flight: set):
+    """Оборачивает колбэки обработчиков, чтобы замерять время каждого вызова."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = handler.callback
+            name = getattr(callback, '__qualname__', repr(callback))
+
+            async def timed(update, context, _callback=callback, _name=name):
+                task = asyncio.current_task()
+                in_flight.add(task)
+                start = time.perf_counter()
+                try:
+                    return await _callback(update, context)
+                finally:
+                    latencies[_name].append(time.perf_counter() - start)
+                    in_flight.discard(task)
+
+            handler.callback = timed
+
+
+def rss_kb() -> int:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def run(args):
+    config.CONCURRENT_UPDATES = args.concurrency
+    request = StubRequest(args.latency_ms / 1000)
+    builder = (
+        ApplicationBuilder()
+        .token('123456:BENCHMARK')
+        .request(request)
+        .get_updates_request(StubRequest(0))
+        .updater(None)
+    )
+    application = main.build_application(builder)
+    latencies = defaultdict(list)
+    in_flight = set()
+    instrument(application, latencies, in_flight)
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    # Синтетическому потоку нужны стоп-слова, а они загружаются в фоне при старте
+    await config.word_lists.wait_loaded()
+
+    if args.replay:
+        raw_updates = list(recorded_updates(args.replay))
+    else:
+        raw_updates = list(synthetic_updates(args.updates, args.chats, args.users, args.seed))
+
+    if args.trace_memory:
+        tracemalloc.start()
+    rss_before = rss_kb()
+    start = time.perf_counter()
+    # Обновления идут через update_queue, как при боевом запуске: их разбирает
+    # PerChatUpdateProcessor с параллельностью CONCURRENT_UPDATES
+    for raw in raw_updates:
+        await application.update_queue.put(Update.de_json(raw, application.bot))
+        while application.update_queue.qsize() > args.max_queued:
+            await asyncio.sleep(0.001)
+    await application.update_queue.join()
+    while in_flight:
+        await asyncio.sleep(0.001)
+    handled = time.perf_counter() - start
+    traced = tracemalloc.get_traced_memory() if args.trace_memory else None
+    if args.trace_memory:
+        tracemalloc.stop()
+    rss_after = rss_kb()
+
+    drain_start = time.perf_counter()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    drained = time.perf_counter() - drain_start
+
+    print(f"Обновлений: {len(raw_updates)}, задержка API: {args.latency_ms} мс, параллельность: {args.concurrency}")
+    print(f"Обработка: {handled:.2f} с, {len(raw_updates) / handled:,.0f} обновлений/с")
+    print(f"Досылка очереди исходящих действий и сохранение состояния: {drained:.2f} с")
+    print(f"\n{'обработчик':<45} {'вызовов':>8} {'p50, мс':>9} {'p99, мс':>9}")
+    all_latencies = []
+    for name, values in sorted(latencies.items()):
+        all_latencies.extend(values)
+        print(f"{name:<45} {len(values):>8} {percentile(values, 0.5) * 1e3:>9.2f} {percentile(values, 0.99) * 1e3:>9.2f}")
+    print(f"{'все':<45} {len(all_latencies):>8} {percentile(all_latencies, 0.5) * 1e3:>9.2f} "
+          f"{percentile(all_latencies, 0.99) * 1e3:>9.2f}")
+    print("\nВызовы Bot API:", ', '.join(f"{k}={v}" for k, v in request.calls.most_common()))
+    if traced:
+        print(f"Память (tracemalloc): сейчас {traced[0] / 2**20:.1f} МБ, пик {traced[1] / 2**20:.1f} МБ")
+    print(f"Рост пикового RSS: {(rss_after - rss_before) / 1024:.1f} МБ")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--updates', type=int, default=10_000, help='число синтетических обновлений')
+    parser.add_argument('--chats', type=int, default=50, help='число чатов в синтетическом потоке')
+    parser.add_argument('--users', type=int, default=2_000, help='число пользователей в синтетическом потоке')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--replay', help='файл JSON Lines с записанными обновлениями')
+    parser.add_argument('--latency-ms', type=float, default=50.0, help='задержка ответа заглушки Bot API')
+    parser.add_argument('--concurrency', type=int, default=config.CONCURRENT_UPDATES,
+                        help='сколько обновлений обрабатывать одновременно (CONCURRENT_UPDATES)')
+    parser.add_argument('--max-queued', type=int, default=1_000,
+                        help='сколько обновлений держать в очереди приложения')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='считать память через tracemalloc (заметно замедляет прогон)')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,70 @@
+"""
+Микро-бенчмарк поиска стоп-слов: прежний any()-перебор против автомата Ахо–Корасик.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_matcher
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.matcher import WordMatcher  # noqa: E402
+
+STOPWORDS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'stopwords.txt')
+ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+SIZES = (600, 10_000, 100_000)
+MESSAGES = 200
+
+
+def make_patterns(count: int, rng: random.Random) -> list:
+    """Реальные стоп-слова, дополненные случайными словами до нужного размера."""
+    with open(STOPWORDS_FILE, 'r', encoding='utf-8') as f:
+        words = {line.strip().lower() for line in f if line.strip()}
+    while len(words) < count:
+        words.add(''.join(rng.choice(ALPHABET) for _ in range(rng.randint(5, 12))))
+    return list(words)[:count]
+
+
+def make_messages(rng: random.Random) -> list:
+    """Обычные "чистые" сообщения - худший случай для any(), он проверяет все слова."""
+    return [
+        ' '.join(
+            ''.join(rng.choice(ALPHABET) for _ in range(rng.randint(2, 9)))
+            for _ in range(rng.randint(5, 40))
+        )
+        for _ in range(MESSAGES)
+    ]
+
+
+def per_message_us(check, messages: list) -> float:
+    start = time.perf_counter()
+    for text in messages:
+        check(text)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+def main():
+    rng = random.Random(42)
+    messages = make_messages(rng)
+    print(f"{'слов':>8} | {'сборка, мс':>11} | {'any(), мкс':>11} | {'автомат, мкс':>13} | {'ускорение':>9}")
+    for size in SIZES:
+        patterns = make_patterns(size, rng)
+
+        start = time.perf_counter()
+        matcher = WordMatcher(patterns)
+        build_ms = (time.perf_counter() - start) * 1e3
+
+        # Оба способа должны давать одинаковый ответ
+        for text in messages:
+            assert any(w in text for w in patterns) == (matcher.search(text) is not None)
+
+        scan = per_message_us(lambda text: any(w in text for w in patterns), messages)
+        automaton = per_message_us(matcher.search, messages)
+        print(f"{size:>8} | {build_ms:>11.1f} | {scan:>11.1f} | {automaton:>13.1f} | {scan / automaton:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Профиль запуска бота: через сколько миллисекунд после старта процесса бот
+принимает обновления и когда проверено первое сообщение.
+
+Для каждого размера списка стоп-слов запускается отдельный процесс
+(холодный старт - без готового автомата, теплый - с автоматом из
+MATCHER_CACHE_DIR). В базе заранее лежат chat_data --chats чатов.
+Сеть заменена заглушкой из bench_handlers.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --sizes 600 100000 --chats 20000
+
+Подробнее о том, на что уходит импорт:
+    python -X importtime -c "import main" 2> importtime.txt
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import pickle
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+# Момент старта процесса: интерпретатор уже запущен, но ни один модуль бота не импортирован
+STARTED = float(os.environ.get('BENCH_SPAWNED', time.time()))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ALPHABET = 'абвгдеёжзийклмнопрстуфхцчшщъыьэюя'
+SIZES = (600, 10_000, 100_000)
+CHAT_ID = -1001234567890
+
+
+def _ms() -> float:
+    return (time.time() - STARTED) * 1e3
+
+
+async def child():
+    """Один запуск бота; печатает JSON с отметками времени в мс от старта процесса."""
+    marks = {}
+    import config
+    marks['import config'] = _ms()
+    import main
+    marks['import main'] = _ms()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder
+    from benchmarks.bench_handlers import StubRequest, _user
+
+    builder = (
+        ApplicationBuilder()
+        .token('123456:BENCHMARK')
+        .request(StubRequest(0))
+        .get_updates_request(StubRequest(0))
+        .updater(None)
+    )
+    application = main.build_application(builder)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    marks['принимает обновления'] = _ms()
+
+    word = os.environ['BENCH_WORD']
+    message = {
+        'message_id': 1, 'date': int(time.time()),
+        'chat': {'id': CHAT_ID, 'type': 'supergroup', 'title': 'bench'},
+        'from': _user(10_000), 'text': f"привет {word}",
+    }
+    await application.update_queue.put(Update.de_json({'update_id': 1, 'message': message}, application.bot))
+    await application.update_queue.join()
+    # Обработчик мог еще не закончить: он ждет загрузки стоп-слов
+    await config.word_lists.wait_loaded()
+    # Сообщение со стоп-словом проверено, когда его удаление встало в очередь
+    while config.outbound.pending() == 0:
+        await asyncio.sleep(0.001)
+    marks['проверено первое сообщение'] = _ms()
+    marks['слов'] = len(config.policies.base_words)
+
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    print(json.dumps(marks, ensure_ascii=False))
+
+
+def make_word_file(path: str, size: int, rng: random.Random) -> str:
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(ALPHABET) for _ in range(rng.randint(5, 12))))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(words))
+    return min(words)
+
+
+def make_database(path: str, chats: int):
+    """База с сохраненными chat_data: журналы сообщений, как после долгой работы бота."""
+    from services.message_log import MessageLog
+
+    log = MessageLog(2000)
+    for message_id in range(2000):
+        log.add(message_id, 10_000 + message_id % 300)
+    blob = pickle.dumps({'messages': log}, protocol=pickle.HIGHEST_PROTOCOL)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+    with conn:
+        conn.executemany("INSERT INTO chat_data (chat_id, data) VALUES (?, ?)",
+                         ((-1000000000000 - i, blob) for i in range(chats)))
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='размеры списка стоп-слов')
+    parser.add_argument('--chats', type=int, default=5_000, help='сколько чатов с chat_data лежит в базе')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bot_state.db')
+        make_database(database, args.chats)
+        columns = ('import config', 'import main', 'принимает обновления', 'проверено первое сообщение')
+        print(f"chat_data в базе: {args.chats} чатов; время в мс от старта процесса")
+        print(f"{'слов':>8} | {'автомат':>8} | " + ' | '.join(f'{c:>26}' for c in columns))
+        for size in args.sizes:
+            words_file = os.path.join(tmp, f'stopwords-{size}.txt')
+            word = make_word_file(words_file, size, rng)
+            cache_dir = os.path.join(tmp, 'cache')
+            for start in ('холодный', 'теплый'):
+                env = {
+                    **os.environ,
+                    'STOPWORDS_FILE': words_file, 'MATCHER_CACHE_DIR': cache_dir, 'BOT_DB_PATH': database,
+                    'METRICS_PORT': '0', 'WORDS_WATCH': '0', 'BENCH_WORD': word,
+                    'BENCH_SPAWNED': repr(time.time()),
+                }
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.bench_startup', '--child'],
+                    env=env, capture_output=True, text=True, check=True,
+                ).stdout
+                marks = json.loads(output.strip().splitlines()[-1])
+                assert marks['слов'], marks
+                print(f"{size:>8} | {start:>8} | " + ' | '.join(f'{marks[c]:>26.0f}' for c in columns))
+
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        asyncio.run(child())
+    else:
+        main()
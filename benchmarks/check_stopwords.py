@@ -0,0 +1,101 @@
+"""
+Проверка нормализации списка стоп-слов на ложные срабатывания: нормализованный
+список прогоняется по образцу обычного русского текста. Ошибка (код выхода 1) -
+совпадение, которого нет у исходного списка, если искать его слова в тексте как
+есть (как до нормализации). Совпадения самих исходных слов внутри других
+("скипидар") выводятся отдельно: нормализация их не добавляла.
+
+Образец включает слова, на которых раньше срабатывали нормализованные
+латинские и "двойные" записи списка: "заевший" (zaeb -> заев),
+"писака" (ссака -> сака), "соскучился" (cock -> соск) и т.п.
+
+Запуск из корня проекта:
+    python -m benchmarks.check_stopwords
+    python -m benchmarks.check_stopwords --words words/-1001234567890.txt --sample chat.txt
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.matcher import WordMatcher  # noqa: E402
+from services.normalize import normalize_word, text_forms  # noqa: E402
+
+STOPWORDS_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'stopwords.txt')
+
+CLEAN_SAMPLE = """
+Всем привет! Замок на двери опять заевший, кто знает хорошего мастера?
+Наш местный писака снова выпустил статью про городской парк.
+Я так соскучился по морю, в отпуск поедем в сентябре.
+Доктор сказал, что это обычный симптом простуды, пейте больше чая.
+Соскочил с велосипеда и поцарапал колено, ничего страшного.
+Скипидар и сосновая смола хорошо пахнут в бане.
+Подскажите, где купить саженцы смородины и крыжовника?
+Касса на втором этаже, оплатить можно картой или наличными.
+Масса посылки не больше двух килограммов, отправлю завтра.
+Собака соседа снова лаяла всю ночь, придется поговорить.
+Сосиски с капустой и картошка на ужин - классика.
+Команда выиграла матч со счетом три-один, болельщики в восторге.
+Вчера смотрели спектакль, актеры играли потрясающе.
+Документы подписаны, договор вступает в силу с понедельника.
+Посмотрите расписание электричек, кажется, его снова поменяли.
+Спасибо за помощь, без вас бы не справились!
+Ребята, кто идет на субботник, сбор у подъезда в десять.
+Сосульки на крыше опасные, обходите дом стороной.
+Мастер сказал, что ремонт займет неделю, а то и две.
+Приложение обновилось, теперь уведомления приходят вовремя.
+Купил новый компьютер, скорость работы приятно удивила.
+Хлеб, молоко, яйца, сыр и яблоки - список покупок на завтра.
+Учитель похвалил сына за сочинение про осень.
+Сегодня в библиотеке встреча с автором, вход свободный.
+Погода отличная, пойдем гулять в сквер у набережной.
+Оскорблять друг друга в чате не нужно, давайте уважать соседей.
+Прислала фотографии с выпускного, посмотрите в общей папке.
+Курсы английского начинаются в октябре, запись открыта.
+Выставка скульптуры продлится до конца месяца.
+Сдача отчетов перенесена на пятницу, учтите это.
+Ошибка в коде исправлена, новая сборка уже на сервере.
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', default=STOPWORDS_FILE, help='список стоп-слов (как stopwords.txt)')
+    parser.add_argument('--sample', help='файл с чистым текстом вместо встроенного образца')
+    args = parser.parse_args()
+
+    if args.sample:
+        with open(args.sample, 'r', encoding='utf-8') as f:
+            sample = f.read()
+    else:
+        sample = CLEAN_SAMPLE
+    # Нормализованное слово -> строки файла, из которых оно получилось
+    sources = {}
+    with open(args.words, 'r', encoding='utf-8') as f:
+        for raw in filter(None, (line.strip() for line in f)):
+            sources.setdefault(normalize_word(raw), set()).add(raw.lower())
+    sources.pop('', None)
+    matcher = WordMatcher(sources)
+
+    lines = [line.strip() for line in sample.splitlines() if line.strip()]
+    regressions = existing = 0
+    for line in lines:
+        found = {}
+        for text in text_forms(line):
+            for match in matcher.finditer(text):
+                found.setdefault(match.word, text[max(0, match.start - 15):match.end + 15])
+        for word, context in found.items():
+            if any(raw in line.lower() for raw in sources[word]):
+                existing += 1
+                continue
+            regressions += 1
+            print(f"'{word}' (из {', '.join(sorted(sources[word]))}) в {context!r} <- {line!r}")
+    print(f"Слов в списке: {len(sources)}, строк образца: {len(lines)}, "
+          f"ложных срабатываний из-за нормализации: {regressions}, "
+          f"исходных слов внутри других слов: {existing}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+from datetime import time
+
+import pytz
+
+from services.metrics import MetricsServer, registry
+from services.night_scheduler import NightScheduler
+from services.outbound import OutboundQueue
+from services.policy import ChatPolicy, PolicyRegistry
+from services.storage import SQLiteStorage, Storage
+from services.wordlist import WordLists
+
+# --- Основные настройки ---
+# Токен можно указать прямо здесь или передать через переменную окружения BOT_TOKEN
+BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+
+# --- Получение обновлений ---
+# 'polling' - опрос серверов Telegram, 'webhook' - Telegram сам присылает обновления
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный HTTPS-адрес, на который Telegram будет слать обновления (например, https://bot.example.com).
+# Сам бот слушает локальный адрес, снаружи его обычно закрывает nginx или другой прокси.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token.
+# Если не задан, при каждом запуске генерируется новый.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Сколько обновлений обрабатывать одновременно. Обновления одного чата
+# всегда обрабатываются по порядку, параллельно идут только разные чаты.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+# Шардирование: 0 - все чаты в одном процессе; N - процесс-маршрутизатор
+# и N процессов-воркеров, каждый обрабатывает свою часть чатов (см. sharded.py)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+
+# --- Метрики ---
+# Адрес, на котором отдается /metrics в формате Prometheus (0 - не запускать сервер).
+# В шардированном режиме воркер N слушает METRICS_PORT + N + 1.
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# --- Ночной режим ---
+TIMEZONE = pytz.timezone('Europe/Minsk')
+NIGHT_START_TIME = time(22, 0)
+DAY_START_TIME = time(9, 0)
+# Сколько чатов в секунду переключать, когда наступает ночь или утро
+NIGHT_MODE_CHATS_PER_SECOND = 8
+
+# --- Спам-фильтр ---
+SPAM_MESSAGE_LIMIT = 5
+SPAM_TIME_WINDOW_SECONDS = 10
+SPAM_MUTE_DURATION_HOURS = 1
+# Сколько пользователей на чат одновременно отслеживает спам-фильтр
+SPAM_MAX_TRACKED_USERS = 5000
+
+# --- Рейды (одинаковые сообщения от разных пользователей) ---
+# Сколько разных пользователей за окно должны прислать почти одинаковый текст (0 - выключено)
+DUPLICATE_MIN_USERS = 5
+DUPLICATE_WINDOW_SECONDS = 60
+# Более короткие сообщения (после нормализации) не сравниваются
+DUPLICATE_MIN_LENGTH = 30
+# Сколько последних сообщений на чат помнит детектор
+DUPLICATE_MAX_TRACKED_MESSAGES = 2000
+
+# --- Наплыв новых участников ---
+# Больше JOIN_RAID_LIMIT входов за JOIN_RAID_WINDOW_SECONDS - рейд (0 - выключено)
+JOIN_RAID_LIMIT = 10
+JOIN_RAID_WINDOW_SECONDS = 30
+# Рейд заканчивается, если порог не превышался столько секунд
+JOIN_RAID_CALM_SECONDS = 120
+# Как часто во время рейда отправляется сводное приветствие
+JOIN_RAID_GREETING_SECONDS = 60
+# На сколько часов ограничиваются вошедшие во время рейда (если их не освободят раньше)
+JOIN_RAID_MUTE_HOURS = 24
+
+# --- Кэш администраторов ---
+ADMIN_CACHE_TTL_SECONDS = 300
+ADMIN_CACHE_MAX_CHATS = 10000
+# Сколько последних сообщений (и отмеченных спамеров) на чат помнят пакетные команды
+ADMIN_BATCH_MAX_MESSAGES = 2000
+
+# --- Исходящие действия ---
+# Сколько секунд копить удаления перед пакетным delete_messages
+OUTBOUND_FLUSH_INTERVAL_SECONDS = 0.5
+# Уведомления об удалении за это окно склеиваются в одну сводку
+NOTICE_WINDOW_SECONDS = 5
+# Общий лимит вызовов Bot API в секунду (Telegram допускает около 30)
+API_GLOBAL_RATE = 25
+# Сколько банов/ограничений участников одного чата отправляется одновременно
+OUTBOUND_CALL_CONCURRENCY = 8
+
+# --- Файлы ---
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STOPWORDS_FILE = os.getenv("STOPWORDS_FILE", os.path.join(BASE_DIR, 'stopwords.txt'))
+# Старый файл с чатами ночного режима: при первом запуске переносится в базу
+NIGHT_MODE_FILE = os.path.join(BASE_DIR, 'night_mode_chats.json')
+# База SQLite с состоянием бота (':memory:' - без сохранения на диск)
+DB_PATH = os.getenv("BOT_DB_PATH", os.path.join(BASE_DIR, 'bot_state.db'))
+
+# --- Сохранение состояния ---
+# Как часто накопленные изменения пишутся в базу
+STORAGE_FLUSH_SECONDS = 5
+# Сколько запись ждет базу, занятую другим процессом (воркеры шардированного запуска)
+STORAGE_BUSY_TIMEOUT_SECONDS = 30
+# Как часто PTB передает изменившиеся chat_data (окна спам-фильтра) на сохранение
+PERSISTENCE_UPDATE_SECONDS = 60
+
+# --- Политики чатов ---
+# Сколько чатов держать в памяти с уже скомпилированными правилами
+POLICY_CACHE_SIZE = 1000
+
+# --- Стоп-слова ---
+# Стоп-слова отдельных чатов: файлы <chat_id>.txt в этом каталоге
+CHAT_WORDS_DIR = os.path.join(BASE_DIR, 'words')
+# Следить за файлами со стоп-словами и подхватывать изменения без /reload_words
+WORDS_WATCH = os.getenv("WORDS_WATCH", "1") == "1"
+# Как часто проверять файлы, если inotify недоступен
+WORDS_POLL_SECONDS = 5
+# Каталог для готовых автоматов стоп-слов: пока список не меняется, при запуске
+# автомат читается из файла, а не строится заново (пустое значение - не сохранять)
+MATCHER_CACHE_DIR = os.getenv("MATCHER_CACHE_DIR", os.path.join(BASE_DIR, '.cache'))
+
+# --- Теневой режим ---
+# Правила-кандидаты проверяются рядом с действующими, в лог пишутся только
+# расхождения (в чат ничего не уходит). Включается, если задан хотя бы один файл:
+# список стоп-слов (как stopwords.txt) и/или JSON с поправками к политике чатов.
+SHADOW_WORDS_FILE = os.getenv("SHADOW_WORDS_FILE", "")
+SHADOW_POLICY_FILE = os.getenv("SHADOW_POLICY_FILE", "")
+
+
+# Служебные настройки самого бота хранятся как настройки "чата" 0
+SERVICE_CHAT_ID = 0
+
+
+class BotState:
+    """
+    Состояние бота, которое должно переживать перезапуск (чаты с ночным режимом).
+    Хранится в storage; множество night_mode_chats держится в памяти для
+    быстрой проверки на каждом сообщении и загружается в load() при старте.
+    """
+
+    def __init__(self, storage: Storage, legacy_path: str):
+        self.storage = storage
+        self.legacy_path = legacy_path
+        self.night_mode_chats = set()
+        # В шардированном режиме воркер задает функцию chat_id -> bool:
+        # принадлежит ли чат этому воркеру
+        self.owner = None
+
+    def owns(self, chat_id: int) -> bool:
+        return self.owner is None or self.owner(chat_id)
+
+    async def load(self):
+        self.night_mode_chats = await self.storage.chats_with_setting('night_mode')
+        service = await self.storage.get_chat_settings(SERVICE_CHAT_ID)
+        if not service.get('legacy_night_mode_imported'):
+            self._import_legacy_file()
+            self.storage.set_chat_setting(SERVICE_CHAT_ID, 'legacy_night_mode_imported', True)
+
+    def _import_legacy_file(self):
+        """Переносит чаты из старого night_mode_chats.json в хранилище."""
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                chats = json.load(f).get('chats', [])
+        except FileNotFoundError:
+            return
+        except (json.JSONDecodeError, AttributeError) as e:
+            logging.error(f"Не удалось прочитать {self.legacy_path}: {e}")
+            return
+        for chat_id in chats:
+            self.add_night_mode_chat(chat_id)
+        if chats:
+            logging.info(f"Перенесено чатов с ночным режимом из {self.legacy_path}: {len(chats)}")
+
+    def add_night_mode_chat(self, chat_id: int):
+        self.night_mode_chats.add(chat_id)
+        self.storage.set_chat_setting(chat_id, 'night_mode', True)
+
+    def remove_night_mode_chat(self, chat_id: int):
+        self.night_mode_chats.discard(chat_id)
+        self.storage.delete_chat_setting(chat_id, 'night_mode')
+
+
+# Хранилище состояния; его можно заменить на другую реализацию Storage
+storage = SQLiteStorage(DB_PATH, flush_interval=STORAGE_FLUSH_SECONDS, busy_timeout=STORAGE_BUSY_TIMEOUT_SECONDS)
+bot_state = BotState(storage, legacy_path=NIGHT_MODE_FILE)
+# Очередь исходящих действий (удаления, уведомления, муты); запускается в main.py
+outbound = OutboundQueue(
+    flush_interval=OUTBOUND_FLUSH_INTERVAL_SECONDS,
+    notice_window=NOTICE_WINDOW_SECONDS,
+    global_rate=API_GLOBAL_RATE,
+    call_concurrency=OUTBOUND_CALL_CONCURRENCY,
+)
+# Ночной режим: переключение прав по расписаниям чатов; запускается в main.py
+night_scheduler = NightScheduler(storage, outbound, rate=NIGHT_MODE_CHATS_PER_SECOND)
+registry.gauge('bot_outbound_pending', 'Действия, ждущие отправки в очереди исходящих', outbound.pending)
+metrics_server = MetricsServer(registry, METRICS_HOST, METRICS_PORT)
+# Правила по умолчанию; администраторы могут переопределить их для своего чата
+default_policy = ChatPolicy(
+    spam_message_limit=SPAM_MESSAGE_LIMIT,
+    spam_time_window_seconds=SPAM_TIME_WINDOW_SECONDS,
+    spam_mute_duration_hours=SPAM_MUTE_DURATION_HOURS,
+    duplicate_min_users=DUPLICATE_MIN_USERS,
+    duplicate_window_seconds=DUPLICATE_WINDOW_SECONDS,
+    join_raid_limit=JOIN_RAID_LIMIT,
+    join_raid_window_seconds=JOIN_RAID_WINDOW_SECONDS,
+    night_start=NIGHT_START_TIME.strftime('%H:%M'),
+    night_end=DAY_START_TIME.strftime('%H:%M'),
+    timezone=TIMEZONE.zone,
+)
+policies = PolicyRegistry(storage, default_policy, cache_size=POLICY_CACHE_SIZE)
+# Общий список стоп-слов и списки чатов; автоматы по ним хранятся в policies.
+# Списки загружаются в фоне при запуске бота (main.on_startup)
+word_lists = WordLists(policies, STOPWORDS_FILE, CHAT_WORDS_DIR, poll_interval=WORDS_POLL_SECONDS,
+                       cache_dir=MATCHER_CACHE_DIR or None)
+# Теневые правила (None - теневой режим выключен или правила еще загружаются, см. main.on_startup)
+shadow_rules = None
@@ -3,44 +3,95 @@ from datetime import timedelta, datetime, timezone
 import config
 from telegram import Update, ChatPermissions
 from telegram.ext import ContextTypes
-from telegram.constants import ChatMemberStatus
+from telegram.constants import ChatMemberStatus, ChatType
+from services.admin_cache import AdminCache
+from services.message_log import MessageLog
+from services.night_scheduler import OPEN_PERMISSIONS
+from .common import raid_job_name
+from services.wordlist import WordListError
+
+ADMIN_STATUSES = (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+# Списки администраторов по чатам, чтобы не спрашивать Telegram на каждое сообщение
+admin_cache = AdminCache(ttl=config.ADMIN_CACHE_TTL_SECONDS, max_chats=config.ADMIN_CACHE_MAX_CHATS)
 
 async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
     """
     Проверяет, является ли пользователь, вызвавший команду, администратором чата.
     """
     user_id = update.effective_user.id
-    chat_id = update.effective_chat.id
+    chat = update.effective_chat
+    # В личных сообщениях администраторов нет
+    if chat.type == ChatType.PRIVATE:
+        return False
     try:
-        chat_member = await context.bot.get_chat_member(chat_id, user_id)
-        return chat_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]
+        return await admin_cache.is_admin(context.bot, chat.id, user_id)
     except Exception as e:
         logging.error(f"Ошибка при проверке статуса администратора: {e}")
         return False
 
-async def kick_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def track_chat_members(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Исключает пользователя из чата. Команда доступна только администраторам.
-    Использование: ответьте на сообщение пользователя командой /kick
+    Сбрасывает кэш администраторов чата, когда кого-то назначили или сняли с должности.
+    Обычные входы и выходы участников кэш не трогают.
     """
+    change = update.chat_member or update.my_chat_member
+    if not change:
+        return
+    was_admin = change.old_chat_member.status in ADMIN_STATUSES
+    now_admin = change.new_chat_member.status in ADMIN_STATUSES
+    if was_admin != now_admin:
+        admin_cache.invalidate(change.chat.id)
+
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает статистику кэша администраторов и кэша политик чатов."""
     if not await is_admin(update, context):
         await update.message.reply_text("❌ Эта команда доступна только администраторам.")
         return
-    # Проверяем, что команда используется в ответ на сообщение
-    if not update.message.reply_to_message:
+    stats = admin_cache.stats()
+    policy_stats = config.policies.stats()
+    await update.message.reply_text(
+        f"📊 Кэш администраторов: попаданий {stats['hits']}, промахов {stats['misses']} "
+        f"({stats['hit_rate']:.1%}), чатов в кэше: {stats['chats']}.\n"
+        f"Политики: загружено {policy_stats['policies']}, скомпилировано {policy_stats['compiled']}, "
+        f"версия общего списка слов: {policy_stats['words_version']}."
+    )
+
+async def _reply_target(update: Update, context: ContextTypes.DEFAULT_TYPE, protected: str):
+    """
+    Общая часть команд "в ответ на сообщение": проверяет права вызвавшего и
+    возвращает автора сообщения. Администраторов (ответ protected) и случаи,
+    когда команда вызвана не в ответ, отсекает сама и возвращает None.
+    Оба списка администраторов берутся из одного кэша, без get_chat_member.
+    """
+    if not await is_admin(update, context):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return None
+    reply = update.message.reply_to_message
+    if not reply or not reply.from_user:
         await update.message.reply_text("❌ Эту команду нужно использовать в ответ на сообщение пользователя.")
-        return
+        return None
+    try:
+        admins = await admin_cache.get_admins(context.bot, update.effective_chat.id)
+    except Exception as e:
+        await update.message.reply_text(f"Не удалось проверить права пользователя. Ошибка: {e}")
+        return None
+    if reply.from_user.id in admins:
+        await update.message.reply_text(protected)
+        return None
+    return reply.from_user
 
-    user_to_kick = update.message.reply_to_message.from_user
+async def kick_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Исключает пользователя из чата. Команда доступна только администраторам.
+    Использование: ответьте на сообщение пользователя командой /kick
+    """
+    user_to_kick = await _reply_target(update, context, "❌ Нельзя исключить администратора.")
+    if not user_to_kick:
+        return
     chat_id = update.effective_chat.id
 
     try:
-        # Проверяем, что мы не пытаемся кикнуть администратора
-        target_member = await context.bot.get_chat_member(chat_id, user_to_kick.id)
-        if target_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            await update.message.reply_text("❌ Нельзя исключить администратора.")
-            return
-
         await context.bot.unban_chat_member(chat_id=chat_id, user_id=user_to_kick.id)
         await update.message.reply_text(f"👋 Пользователь {user_to_kick.full_name} был исключен из чата.")
     except Exception as e:
@@ -52,48 +103,34 @@ async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Банит пользователя в чате. Команда доступна только администраторам.
     Использование: ответьте на сообщение пользователя командой /ban
     """
-    if not await is_admin(update, context):
-        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
-        return
-    if not update.message.reply_to_message:
-        await update.message.reply_text("❌ Эту команду нужно использовать в ответ на сообщение пользователя.")
+    user_to_ban = await _reply_target(update, context, "❌ Нельзя забанить администратора.")
+    if not user_to_ban:
         return
-
-    user_to_ban = update.message.reply_to_message.from_user
     chat_id = update.effective_chat.id
 
     try:
-        # Проверяем, что мы не пытаемся забанить администратора
-        target_member = await context.bot.get_chat_member(chat_id, user_to_ban.id)
-        if target_member.status in [ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER]:
-            await update.message.reply_text("❌ Нельзя забанить администратора.")
-            return
-
         await context.bot.ban_chat_member(chat_id=chat_id, user_id=user_to_ban.id)
         await update.message.reply_text(f"🔨 Пользователь {user_to_ban.full_name} забанен.")
     except Exception as e:
         await update.message.reply_text(f"Не удалось забанить пользователя. Ошибка: {e}")
 
 
+def _minutes(context: ContextTypes.DEFAULT_TYPE, default: int = 60) -> int:
+    if context.args and context.args[0].isdigit():
+        return int(context.args[0])
+    return default
+
+
 async def mute_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Запрещает пользователю отправлять сообщения на определенное время."""
-    if not await is_admin(update, context):
-        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
-        return
-
-    if not update.message.reply_to_message:
-        await update.message.reply_text("❌ Используйте команду в ответ на сообщение пользователя.")
+    user_to_mute = await _reply_target(update, context, "❌ Нельзя ограничить администратора.")
+    if not user_to_mute:
         return
-
-    user_to_mute = update.message.reply_to_message.from_user
     chat_id = update.effective_chat.id
-    minutes = 60
+    minutes = _minutes(context)
     until = datetime.now(timezone.utc) + timedelta(minutes=minutes)
-    if context.args and context.args[0].isdigit():
-        minutes = int(context.args[0])
 
     try:
-        # ИСПРАВЛЕНО: Вместо вычисления даты передаем просто длительность
         await context.bot.restrict_chat_member(
             chat_id=chat_id,
             user_id=user_to_mute.id,
@@ -110,41 +147,174 @@ async def unmute_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Снимает ограничения с пользователя.
     Использование: /unmute в ответ на сообщение.
     """
-
-    if not await is_admin(update, context):
-        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+    user_to_unmute = await _reply_target(update, context, "❌ С администратора нечего снимать.")
+    if not user_to_unmute:
         return
-
-    if not update.message.reply_to_message:
-        await update.message.reply_text("❌ Эту команду нужно использовать в ответ на сообщение пользователя.")
-        return
-
-    user_to_unmute = update.message.reply_to_message.from_user
     chat_id = update.effective_chat.id
 
     try:
         await context.bot.restrict_chat_member(
             chat_id=chat_id,
             user_id=user_to_unmute.id,
-            permissions=ChatPermissions(
-                can_send_messages = True,
-                can_send_media_messages = True,
-                can_send_other_messages = True,
-                can_add_web_page_previews = True
-            )
+            permissions=OPEN_PERMISSIONS
         )
         await update.message.reply_text(f"С пользователя {user_to_unmute.full_name} сняты ограничения.")
     except Exception as e:
         await update.message.reply_text(f"Не удалось снять ограничения. Ошибка: {e}")
 
+# --- Пакетные команды ---
+# Авторы берутся из журнала сообщений чата (services.message_log), а сами
+# баны и ограничения уходят через очередь исходящих действий: параллельно,
+# в пределах лимитов Telegram, и команда не ждет, пока они выполнятся.
+
+def get_message_log(context: ContextTypes.DEFAULT_TYPE) -> MessageLog:
+    """Журнал последних сообщений чата из chat_data."""
+    log = context.chat_data.get('messages')
+    if log is None:
+        log = context.chat_data['messages'] = MessageLog(config.ADMIN_BATCH_MAX_MESSAGES)
+    return log
+
+async def record_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Запоминает автора каждого нового сообщения для пакетных команд: и текста,
+    и стикеров, голосовых, медиа без подписи, которые модерация не проверяет.
+    Правки не записываются - сообщение уже есть в журнале.
+    """
+    message = update.message
+    user = update.effective_user
+    if not message or not user or update.effective_chat.type == ChatType.PRIVATE:
+        return
+    if await is_admin(update, context):
+        return
+    get_message_log(context).add(message.message_id, user.id)
+
+async def _range_targets(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Сообщения от того, на которое ответили, до команды и их авторы без
+    администраторов. None - команду выполнять не нужно (ответ уже отправлен).
+    """
+    if not await is_admin(update, context):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return None
+    reply = update.message.reply_to_message
+    if not reply:
+        await update.message.reply_text("❌ Ответьте этой командой на первое сообщение диапазона.")
+        return None
+    messages = get_message_log(context).between(reply.message_id, update.message.message_id)
+    if not messages:
+        await update.message.reply_text("❌ Этих сообщений уже нет в журнале бота.")
+        return None
+    try:
+        admins = await admin_cache.get_admins(context.bot, update.effective_chat.id)
+    except Exception as e:
+        await update.message.reply_text(f"Не удалось проверить права пользователей. Ошибка: {e}")
+        return None
+    users = [user_id for user_id in dict.fromkeys(user_id for _, user_id in messages) if user_id not in admins]
+    return [message_id for message_id, _ in messages], users
+
+async def ban_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Банит авторов всех сообщений от выбранного до этой команды и удаляет сообщения.
+    Использование: /ban_range в ответ на первое сообщение.
+    """
+    targets = await _range_targets(update, context)
+    if not targets:
+        return
+    message_ids, users = targets
+    chat_id = update.effective_chat.id
+    for user_id in users:
+        config.outbound.call(chat_id, 'ban_chat_member', user_id=user_id)
+    for message_id in message_ids:
+        config.outbound.delete(chat_id, message_id)
+    logging.info(f"/ban_range в чате {chat_id}: {len(users)} пользователей, {len(message_ids)} сообщений")
+    await update.message.reply_text(f"🔨 Баню пользователей: {len(users)}, удаляю сообщений: {len(message_ids)}.")
+
+async def mute_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Лишает права голоса авторов всех сообщений от выбранного до этой команды.
+    Использование: /mute_range [минут] в ответ на первое сообщение.
+    """
+    targets = await _range_targets(update, context)
+    if not targets:
+        return
+    _, users = targets
+    chat_id = update.effective_chat.id
+    minutes = _minutes(context)
+    until = datetime.now(timezone.utc) + timedelta(minutes=minutes)
+    for user_id in users:
+        config.outbound.call(
+            chat_id, 'restrict_chat_member',
+            user_id=user_id,
+            permissions=ChatPermissions(can_send_messages=False),
+            until_date=until
+        )
+    await update.message.reply_text(f"🔇 Лишаю права голоса на {minutes} минут пользователей: {len(users)}.")
+
+async def ban_flagged(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Банит всех, кого недавно отметили спам-проверки (флуд, одинаковые сообщения).
+    Участники, вошедшие во время наплыва, только ограничены и остаются
+    ждать /raid_release: среди них бывают и обычные люди.
+    Использование: /ban_flagged
+    """
+    if not await is_admin(update, context):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return
+    chat_id = update.effective_chat.id
+    log = get_message_log(context)
+    users = set(log.flagged())
+    try:
+        users -= await admin_cache.get_admins(context.bot, chat_id)
+    except Exception as e:
+        await update.message.reply_text(f"Не удалось проверить права пользователей. Ошибка: {e}")
+        return
+    if not users:
+        await update.message.reply_text("Нет отмеченных спамеров.")
+        return
+    for user_id in sorted(users):
+        config.outbound.call(chat_id, 'ban_chat_member', user_id=user_id)
+    log.clear_flagged()
+    # Забаненным /raid_release уже не нужен
+    guard = context.chat_data.get('joins')
+    if guard is not None:
+        guard.wave -= users
+    logging.info(f"/ban_flagged в чате {chat_id}: {len(users)} пользователей")
+    await update.message.reply_text(f"🔨 Баню отмеченных спамеров: {len(users)}.")
+
+async def release_raid(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Снимает ограничения со всех, кто вошел в чат во время наплыва (рейда),
+    и завершает рейд. Использование: /raid_release
+    """
+    if not await is_admin(update, context):
+        await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+        return
+    chat_id = update.effective_chat.id
+    guard = context.chat_data.get('joins')
+    if guard is None or not (guard.wave or guard.active):
+        await update.message.reply_text("Нет участников, ограниченных из-за наплыва.")
+        return
+    users = guard.release()
+    for job in context.job_queue.get_jobs_by_name(raid_job_name(chat_id)):
+        job.schedule_removal()
+    # Вызовы идут через очередь исходящих действий: сотни участников
+    # освобождаются в пределах лимитов Telegram, команда не ждет их все
+    for user_id in users:
+        config.outbound.call(chat_id, 'restrict_chat_member', user_id=user_id, permissions=OPEN_PERMISSIONS)
+    await update.message.reply_text(f"✅ Снимаю ограничения с новых участников: {len(users)}.")
+
 async def reload_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    Перезагружает список стоп-слов из файла.
-    Доступно только администраторам.
+    Перезагружает списки стоп-слов из файлов (обычно это происходит само,
+    см. services.wordlist). Доступно только администраторам.
     """
 # Можно добавить проверку на администратора, если нужно
     if not await is_admin(update, context):
         await update.message.reply_text("Эта команда доступна только администраторам.")
         return
-    count = config.load_forbidden_words()
+    try:
+        count = await config.word_lists.reload()
+    except WordListError as e:
+        await update.message.reply_text(f"❌ Не удалось загрузить стоп-слова ({e}), действует прежний список.")
+        return
     await update.message.reply_text(f"✅ Список стоп-слов успешно перезагружен. Загружено слов: {count}.")
\ No newline at end of file
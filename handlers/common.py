@@ -1,5 +1,16 @@
-from telegram import Update
+import logging
+from datetime import datetime, timedelta, timezone
+from telegram import Update, ChatPermissions
 from telegram.ext import ContextTypes
+from config import (
+    JOIN_RAID_CALM_SECONDS,
+    JOIN_RAID_GREETING_SECONDS,
+    JOIN_RAID_MUTE_HOURS,
+    outbound,
+    policies
+)
+from services.join_guard import JoinGuard
+from services.policy import ChatPolicy
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отправляет приветственное сообщение."""
@@ -8,7 +19,84 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text="Привет! Я бот-модератор. Я буду следить за порядком в этом чате."
     )
 
+def raid_job_name(chat_id: int) -> str:
+    return f"join_raid_{chat_id}"
+
+def get_join_guard(context: ContextTypes.DEFAULT_TYPE, policy: ChatPolicy):
+    """Счетчик входов чата из chat_data; None, если проверка наплыва выключена."""
+    guard = context.chat_data.get('joins')
+    if policy.join_raid_limit <= 0:
+        return guard if guard is not None and guard.active else None
+    if guard is None:
+        guard = context.chat_data['joins'] = JoinGuard(
+            policy.join_raid_limit, policy.join_raid_window_seconds, JOIN_RAID_CALM_SECONDS
+        )
+    elif guard.limit != policy.join_raid_limit or guard.window != policy.join_raid_window_seconds:
+        # Пороги поменяли: волна текущего рейда сохраняется
+        guard.configure(policy.join_raid_limit, policy.join_raid_window_seconds)
+    return guard
+
 async def welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Приветствует новых участников чата."""
-    names = ", ".join(m.full_name for m in update.message.new_chat_members)
-    await update.message.reply_text(f"Добро пожаловать в чат, {names}!")
+    """
+    Приветствует новых участников чата. Во время наплыва (рейда) новые
+    участники ограничиваются, а вместо приветствия каждому раз в
+    JOIN_RAID_GREETING_SECONDS отправляется одно сводное.
+    """
+    message = update.message
+    members = [m for m in message.new_chat_members if m.id != context.bot.id]
+    if not members:
+        return
+    chat_id = message.chat_id
+    guard = get_join_guard(context, await policies.get_policy(chat_id))
+    wave = guard.joined([m.id for m in members]) if guard is not None else None
+    if wave is None:
+        names = ", ".join(m.full_name for m in members)
+        await message.reply_text(f"Добро пожаловать в чат, {names}!")
+        return
+
+    # Рейд: ограничения уходят через очередь исходящих действий с ее лимитами,
+    # служебное сообщение о входе удаляется вместе с остальными пакетом
+    until = datetime.now(timezone.utc) + timedelta(hours=JOIN_RAID_MUTE_HOURS)
+    for user_id in wave:
+        outbound.call(
+            chat_id, 'restrict_chat_member',
+            user_id=user_id,
+            permissions=ChatPermissions(can_send_messages=False),
+            until_date=until
+        )
+    outbound.delete(chat_id, message.message_id)
+
+    if not context.job_queue.get_jobs_by_name(raid_job_name(chat_id)):
+        logging.warning(f"Наплыв новых участников в чате {chat_id}, приветствия объединяются")
+        outbound.call(
+            chat_id, 'send_message',
+            text="🛡 Слишком много новых участников сразу. Новички смогут писать после проверки администраторами."
+        )
+        context.job_queue.run_repeating(
+            raid_greeting, interval=JOIN_RAID_GREETING_SECONDS, first=JOIN_RAID_GREETING_SECONDS,
+            chat_id=chat_id, name=raid_job_name(chat_id)
+        )
+
+async def raid_greeting(context: ContextTypes.DEFAULT_TYPE):
+    """Сводное приветствие во время рейда; когда наплыв стихает, задача завершается."""
+    chat_id = context.job.chat_id
+    guard = context.chat_data.get('joins')
+    if guard is None or not guard.active:
+        context.job.schedule_removal()
+        return
+    if guard.pending:
+        outbound.call(
+            chat_id, 'send_message',
+            text=f"👋 Добро пожаловать, новые участники ({guard.pending})!",
+            disable_notification=True
+        )
+        guard.pending = 0
+    if guard.calmed():
+        guard.finish()
+        context.job.schedule_removal()
+        logging.info(f"Наплыв в чате {chat_id} закончился, в волне {len(guard.wave)} участников")
+        outbound.call(
+            chat_id, 'send_message',
+            text=f"🛡 Наплыв закончился. Ограничено новых участников: {len(guard.wave)}. "
+                 f"Снять ограничения со всех: /raid_release"
+        )
@@ -1,145 +1,336 @@
+from contextlib import nullcontext
 from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
 from telegram import Update, ChatPermissions
 from telegram.ext import ContextTypes
-from telegram.constants import ChatMemberStatus
 import logging
-from .admin import is_admin
+from .admin import get_message_log, is_admin
+from services.duplicates import DuplicateDetector, Raid
+from services.flood import FloodDetector
+from services.links import LOOKALIKE, extract_urls
+from services.metrics import shadow_diffs, stage_seconds
+from services.normalize import normalize_text, text_forms
 
-# Импортируем настройки из конфига
+from services.policy import ChatPolicy, CompiledPolicy
+
+# Пороги, стоп-слова и разрешенные ссылки берутся из политики чата
+# (config.policies), а не из констант config
 from config import (
-    FORBIDDEN_WORDS,
-    SPAM_MESSAGE_LIMIT,
-    SPAM_TIME_WINDOW_SECONDS,
-    SPAM_MUTE_DURATION_HOURS,
-    bot_state
+    DUPLICATE_MAX_TRACKED_MESSAGES,
+    DUPLICATE_MIN_LENGTH,
+    SPAM_MAX_TRACKED_USERS,
+    bot_state,
+    outbound,
+    policies
 )
+import config
 
-async def check_for_spam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Проверяет пользователя на спам. Возвращает True, если обнаружен спам."""
-    user = update.effective_user
-    if not user: return False
+# Решения проверок. Решение принимается отдельно от действий (см. evaluate и
+# apply_verdict), поэтому те же проверки работают офлайн (scorer.py) и в теневом режиме.
+FLOOD, FORWARD, RAID, WORD, LINK, LOOKALIKE_LINK = 'flood', 'forward', 'raid', 'word', 'link', 'lookalike'
+# Решения, после которых автор еще и лишается права голоса
+MUTING = frozenset({FLOOD, RAID})
 
-    user_id = user.id
-    chat_id = update.effective_chat.id
-    now = datetime.now()
 
-    # Получаем или создаем хранилище для сообщений пользователей
-    if 'user_messages' not in context.chat_data:
-        context.chat_data['user_messages'] = {}
+class Verdict(NamedTuple):
+    """Что проверка решила сделать с сообщением: reason - одно из FLOOD, FORWARD, ..."""
+    reason: str
+    detail: str = ''
+    raid: Optional[Raid] = None
 
-    user_messages = context.chat_data['user_messages']
-    # Получаем список временных меток (timestamp) для текущего пользователя.
-    # Если пользователя еще нет в словаре, для него создастся пустой список.
-    timestamps = user_messages.get(user_id, [])
 
-    # Фильтруем список: создаем новый, содержащий только "свежие" сообщения.
-    recent_timestamps = [ts for ts in timestamps if (now - ts).total_seconds() < SPAM_TIME_WINDOW_SECONDS]
+def detect_flood(chat_data: Dict, policy: ChatPolicy, user_id: int, now: Optional[float] = None) -> bool:
+    """Учитывает сообщение в спам-фильтре чата. Возвращает True, если это флуд."""
+    # Получаем или создаем счетчик сообщений для этого чата.
+    # Если администратор поменял пороги, счетчик создается заново.
+    detector = chat_data.get('flood')
+    if (detector is None or detector.limit != policy.spam_message_limit
+            or detector.window != policy.spam_time_window_seconds):
+        detector = chat_data['flood'] = FloodDetector(
+            policy.spam_message_limit, policy.spam_time_window_seconds, SPAM_MAX_TRACKED_USERS
+        )
+    is_flood = detector.hit(user_id, now)
+    if is_flood:
+        # Очищаем историю сообщений спамера после наказания
+        detector.reset(user_id)
+    return is_flood
 
-    # Добавляем время текущего сообщения.
-    recent_timestamps.append(now)
+def punish_flood(chat_id: int, user_id: int, username: Optional[str], policy: ChatPolicy):
+    # Мут и уведомление уходят через очередь исходящих действий,
+    # обработчик не ждет ответа Telegram.
+    outbound.call(
+        chat_id, 'restrict_chat_member',
+        user_id=user_id,
+        permissions=ChatPermissions(can_send_messages=False),
+        until_date=datetime.now(timezone.utc) + timedelta(hours=policy.spam_mute_duration_hours)
+    )
+    outbound.notice(
+        chat_id, 'мут за спам',
+        f"Пользователь @{username} был заглушен на {policy.spam_mute_duration_hours:g} часов за спам."
+    )
 
-    # Сохраняем обновленный список обратно в хранилище.
-    user_messages[user_id] = recent_timestamps
+def check_for_duplicates(chat_data: Dict, policy: ChatPolicy, normalized: str,
+                         user_id: int, message_id: int, now: Optional[float] = None):
+    """
+    Учитывает сообщение в детекторе одинаковых сообщений чата (services.duplicates).
+    Возвращает Raid, если сообщение входит в рейд, иначе None.
+    """
+    if policy.duplicate_min_users <= 0:
+        return None
+    # Детектор живет в chat_data и создается заново, если поменялись пороги
+    detector = chat_data.get('duplicates')
+    if (detector is None or detector.min_users != policy.duplicate_min_users
+            or detector.window != policy.duplicate_window_seconds):
+        detector = chat_data['duplicates'] = DuplicateDetector(
+            policy.duplicate_min_users, policy.duplicate_window_seconds,
+            DUPLICATE_MIN_LENGTH, DUPLICATE_MAX_TRACKED_MESSAGES
+        )
+    return detector.check(normalized, user_id, message_id, now)
 
-    # --- Отладочная информация ---
-    logging.info(
-        f"[SPAM CHECK] User: {user.username} ({user_id}) | "
-        f"Messages in window: {len(recent_timestamps)}/{SPAM_MESSAGE_LIMIT}"
-    )
+def punish_raid(chat_id: int, raid: Raid, policy: ChatPolicy):
+    """Удаляет все сообщения кластера и заглушает всех его участников разом."""
+    for _, message_id in raid.messages:
+        outbound.delete(chat_id, message_id)
+    until = datetime.now(timezone.utc) + timedelta(hours=policy.spam_mute_duration_hours)
+    for user_id in raid.users:
+        outbound.call(
+            chat_id, 'restrict_chat_member',
+            user_id=user_id,
+            permissions=ChatPermissions(can_send_messages=False),
+            until_date=until
+        )
+    # О рейде сообщаем один раз, следующие сообщения кластера удаляются молча
+    if raid.new:
+        logging.info(f"Рейд в чате {chat_id}: {len(raid.messages)} сообщений от {len(raid.users)} пользователей")
+        outbound.notice(
+            chat_id, 'рейд',
+            f"🚫 Удалено {len(raid.messages)} одинаковых сообщений от {len(raid.users)} пользователей, "
+            f"они заглушены на {policy.spam_mute_duration_hours:g} ч."
+        )
 
-    # Проверяем, превысил ли пользователь лимит.
-    if len(recent_timestamps) >= SPAM_MESSAGE_LIMIT:
-        try:
-            await context.bot.restrict_chat_member(
-                chat_id=chat_id,
-                user_id=user_id,
-                permissions=ChatPermissions(can_send_messages=False),
-                until_date=datetime.now(timezone.utc) + timedelta(hours=SPAM_MUTE_DURATION_HOURS)
-            )
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"Пользователь @{user.username} был заглушен на {SPAM_MUTE_DURATION_HOURS} часов за спам."
-            )
-            # Очищаем историю сообщений спамера после наказания
-            user_messages[user_id] = []
-            return True
-        except Exception as e:
-            logging.warning(f"Не удалось выдать мут за спам (возможно, это не супергруппа): {e}")
+class Inspection:
+    """
+    Сообщение на проверке и все, что о нем уже известно. Создается один раз
+    на обновление и передается каждой проверке: политика чата читается один
+    раз, а нормализованный текст и ссылки вычисляются при первом обращении
+    и дальше переиспользуются.
 
-    return False
+    Живые сообщения приходят через from_update, офлайн-оценка (scorer.py)
+    собирает Inspection из выгрузки чата. now - время сообщения для
+    спам-фильтров (None - текущее).
+    """
 
-async def delete_forwarded_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Удаляет пересланные сообщения от обычных пользователей."""
-    message = update.effective_message
-    user = update.effective_user
-    if not message or not user: return
+    __slots__ = ('compiled', 'chat_id', 'message_id', 'user_id', 'username', 'author', 'text',
+                 'forwarded', 'edited', 'now', '_entities', '_normalized', '_forms', '_urls')
 
-    # Проверяем, является ли пользователь администратором
-    if await is_admin(update, context):
-        return
+    def __init__(self, compiled: CompiledPolicy, chat_id: int, message_id: int, user_id: int, text: str,
+                 username: Optional[str] = None, author: str = "Пользователь", forwarded: bool = False,
+                 edited: bool = False, entities: Dict = None, now: Optional[float] = None):
+        self.compiled = compiled
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.user_id = user_id
+        self.username = username
+        self.author = author
+        # Текст сообщения или подпись к фото, видео, документу
+        self.text = text
+        self.forwarded = forwarded
+        self.edited = edited
+        self.now = now
+        # Ссылки, размеченные Telegram: {MessageEntity: текст}, см. extract_urls
+        self._entities = entities
+        self._normalized: Optional[str] = None
+        self._forms: Optional[Tuple[str, ...]] = None
+        self._urls: Optional[List[str]] = None
 
-    try:
-        await message.delete()
-        username = user.username or user.first_name or "Пользователь"
-        await context.bot.send_message(
-        chat_id=message.chat_id,
-        text=f"🚫 Сообщение от {username} удалено (пересылка запрещена).",
-        disable_notification=True
-    )
-    except Exception as e:
-        logging.error(f"Не удалось удалить пересланное сообщение: {e}")
+    @classmethod
+    def from_update(cls, update: Update, compiled: CompiledPolicy) -> 'Inspection':
+        message = update.effective_message
+        user = update.effective_user
+        if message.entities:
+            entities = message.parse_entities(['url', 'text_link'])
+        elif message.caption_entities:
+            entities = message.parse_caption_entities(['url', 'text_link'])
+        else:
+            entities = None
+        return cls(
+            compiled, message.chat_id, message.message_id, user.id, message.text or message.caption or '',
+            username=user.username, author=user.username or user.first_name or "Пользователь",
+            forwarded=bool(message.forward_origin),
+            edited=bool(update.edited_message or update.edited_channel_post),
+            entities=entities,
+        )
+
+    def with_policy(self, compiled: CompiledPolicy) -> 'Inspection':
+        """То же сообщение под другими правилами; нормализованный текст и ссылки не пересчитываются."""
+        other = Inspection(compiled, self.chat_id, self.message_id, self.user_id, self.text, self.username,
+                           self.author, self.forwarded, self.edited, self._entities, self.now)
+        other._normalized, other._forms, other._urls = self.normalized, self._forms, self._urls
+        return other
+
+    @property
+    def policy(self) -> ChatPolicy:
+        return self.compiled.policy
+
+    @property
+    def normalized(self) -> str:
+        # Текст приводится к тому же виду, что и список стоп-слов (двойники букв,
+        # цифры, пунктуация), один раз для всех проверок
+        if self._normalized is None:
+            self._normalized = normalize_text(self.text)
+        return self._normalized
+
+    @property
+    def forms(self) -> Tuple[str, ...]:
+        # Виды текста для поиска стоп-слов, первый из них - normalized
+        if self._forms is None:
+            self._forms = text_forms(self.text)
+        return self._forms
+
+    @property
+    def urls(self) -> List[str]:
+        # Ссылки и размеченные Telegram (в тексте или в подписи), и найденные в самом тексте
+        if self._urls is None:
+            self._urls = list(extract_urls(self.text, self._entities))
+        return self._urls
+
+
+# Каждая проверка возвращает Verdict, если сообщение надо удалить, иначе None.
+# Состояние спам-фильтров хранится в state (chat_data чата).
+
+def _check_flood(state: Dict, item: Inspection) -> Optional[Verdict]:
+    # Правка - не новое сообщение, в счетчик флуда она не идет
+    if item.edited or not detect_flood(state, item.policy, item.user_id, item.now):
+        return None
+    return Verdict(FLOOD)
+
+def _check_forward(state: Dict, item: Inspection) -> Optional[Verdict]:
+    # Пересланные сообщения от обычных пользователей удаляются
+    return Verdict(FORWARD) if item.forwarded else None
+
+def _check_duplicates(state: Dict, item: Inspection) -> Optional[Verdict]:
+    # Рейд: почти одинаковый текст от многих пользователей сразу
+    if item.edited or not item.text:
+        return None
+    raid = check_for_duplicates(state, item.policy, item.normalized, item.user_id, item.message_id, item.now)
+    return Verdict(RAID, raid=raid) if raid else None
+
+def _check_words(state: Dict, item: Inspection) -> Optional[Verdict]:
+    # Проход автомата по каждому виду текста (обычно их один-два, см. text_forms).
+    # Позиция совпадения указывается в том виде текста, где оно найдено.
+    if not item.text:
+        return None
+    for text in item.forms:
+        match = item.compiled.matcher.search(text)
+        if match:
+            return Verdict(WORD, f"'{match.word}' ({match.start}-{match.end})")
+    return None
+
+def _check_links(state: Dict, item: Inspection) -> Optional[Verdict]:
+    # Запрещенные домены и подделки под известные удаляются всегда,
+    # остальные ссылки - если они запрещены в чате и домена нет в разрешенных.
+    if not item.text:
+        return None
+    blocked = item.compiled.links.first_blocked(item.urls, item.policy.block_links)
+    if not blocked:
+        return None
+    url, verdict = blocked
+    return Verdict(LOOKALIKE_LINK if verdict == LOOKALIKE else LINK, url)
+
+# Проверки по порядку: (этап для метрик, проверка)
+CHECKS = (
+    ('flood', _check_flood),
+    ('forward', _check_forward),
+    ('duplicates', _check_duplicates),
+    ('words', _check_words),
+    ('links', _check_links),
+)
+# В чатах с ночным режимом свои ограничения, там удаляются только пересылки
+NIGHT_CHECKS = (('forward', _check_forward),)
+
+def evaluate(state: Dict, item: Inspection, checks=CHECKS, timed: bool = True) -> Optional[Verdict]:
+    """Прогоняет сообщение через проверки до первого решения. Сам ничего не отправляет."""
+    for stage, check in checks:
+        with stage_seconds.time(stage) if timed else nullcontext():
+            verdict = check(state, item)
+        if verdict:
+            return verdict
+    return None
+
+def apply_verdict(context: ContextTypes.DEFAULT_TYPE, item: Inspection, verdict: Verdict):
+    """Выполняет решение: удаление, мут и уведомление - через очередь исходящих действий."""
+    chat_id = item.chat_id
+    if verdict.reason == FLOOD:
+        outbound.delete(chat_id, item.message_id)
+        punish_flood(chat_id, item.user_id, item.username, item.policy)
+        get_message_log(context).flag([item.user_id])
+    elif verdict.reason == RAID:
+        punish_raid(chat_id, verdict.raid, item.policy)
+        # Участников рейда администратор может потом забанить разом (/ban_flagged)
+        get_message_log(context).flag(verdict.raid.users)
+    elif verdict.reason == FORWARD:
+        outbound.delete(chat_id, item.message_id)
+        outbound.notice(chat_id, 'пересылки', f"🚫 Сообщение от {item.author} удалено (пересылка запрещена).")
+    elif verdict.reason == WORD:
+        logging.info(f"Стоп-слово {verdict.detail} в сообщении {item.message_id} (позиция в нормализованном тексте)")
+        outbound.delete(chat_id, item.message_id)
+        outbound.notice(
+            chat_id, 'запрещенные слова',
+            f"🚫 Сообщение от @{item.username} удалено, т.к. содержит запрещенное слово."
+        )
+    elif verdict.reason in (LINK, LOOKALIKE_LINK):
+        logging.info(f"Ссылка {verdict.detail} в сообщении {item.message_id}: {verdict.reason}")
+        outbound.delete(chat_id, item.message_id)
+        if verdict.reason == LOOKALIKE_LINK:
+            outbound.notice(
+                chat_id, 'поддельные ссылки',
+                f"🚫 Сообщение от @{item.username} удалено (ссылка на поддельный домен)."
+            )
+        else:
+            outbound.notice(chat_id, 'ссылки', f"🚫 Сообщение от @{item.username} удалено (ссылки запрещены).")
+
+def shadow_check(item: Inspection, checks, verdict: Optional[Verdict]):
+    """
+    Теневой режим: проверяет сообщение правилами-кандидатами (config.shadow_rules)
+    со своим состоянием спам-фильтров и пишет в лог только расхождения с
+    действующими правилами. В чат ничего не отправляется.
+    """
+    shadow_rules = config.shadow_rules
+    candidate = shadow_rules.compiled(item.chat_id, item.policy, policies.chat_words(item.chat_id))
+    shadow = evaluate(shadow_rules.state(item.chat_id), item.with_policy(candidate), checks, timed=False)
+    active_reason = verdict.reason if verdict else 'pass'
+    shadow_reason = shadow.reason if shadow else 'pass'
+    if active_reason != shadow_reason:
+        shadow_diffs.inc(active_reason, shadow_reason)
+        logging.info(
+            f"[SHADOW {shadow_rules.name}] чат {item.chat_id}, сообщение {item.message_id}: "
+            f"{active_reason} -> {shadow_reason} {shadow.detail if shadow else ''}".rstrip()
+        )
 
 async def filter_messages(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Фильтрует входящие текстовые сообщения (новые и отредактированные)."""
+    """
+    Единая проверка сообщений: текст, подписи к медиа, правки и пересылки.
+    Права автора, политика чата, нормализованный текст и ссылки вычисляются
+    один раз на обновление и передаются всем проверкам (см. CHECKS).
+    """
     message = update.effective_message
     user = update.effective_user
-
-    if not message or not user or not message.text:
+    if not message or not user:
         return
 
-    # Пропускаем проверку в чатах с ночным режимом (там свои ограничения)
-    if message.chat_id in bot_state.night_mode_chats:
-        return
+    checks = NIGHT_CHECKS if message.chat_id in bot_state.night_mode_chats else CHECKS
 
     # Пропускаем администраторов
-    if await is_admin(update, context):
+    with stage_seconds.time('admin'):
+        admin = await is_admin(update, context)
+    if admin:
         return
 
-    '''is_spam = await check_for_spam(update, context)
-    if is_spam:
-        return'''
-
-    # Проверка на спам
-    if await check_for_spam(update, context):
-        try:
-            await message.delete()
-        except:
-            pass  # Сообщение уже может быть удалено
-        return
-
-    # Проверка на запрещенные слова
-    if any(word in message.text.lower() for word in FORBIDDEN_WORDS):
-        try:
-            await message.delete()
-            await context.bot.send_message(
-                chat_id=message.chat_id,
-                text=f"🚫 Сообщение от @{user.username} удалено, т.к. содержит запрещенное слово.",
-                disable_notification=True
-            )
-            return
-        except Exception as e:
-            logging.error(f"Не удалось удалить сообщение с запрещенным словом: {e}")
-            return
-
-    # Проверка только на ссылки
-    if message.entities and any(e.type in ['url', 'text_link'] for e in message.entities):
-        try:
-            await message.delete()
-            await context.bot.send_message(
-                chat_id=message.chat_id,
-                text=f"🚫 Сообщение от @{user.username} удалено (ссылки запрещены).",
-                disable_notification=True
-            )
-            return
-        except Exception as e:
-                logging.error(f"Не удалось удалить сообщение со ссылкой: {e}")
+    # Политика читается один раз: если ее поменяют во время проверки,
+    # это сообщение все равно проверится целиком по одной версии правил
+    item = Inspection.from_update(update, await policies.get(message.chat_id))
+    verdict = evaluate(context.chat_data, item, checks)
+    if verdict:
+        apply_verdict(context, item, verdict)
+    if config.shadow_rules is not None:
+        shadow_check(item, checks, verdict)
@@ -0,0 +1,237 @@
+import re
+
+import pytz
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from config import bot_state, night_scheduler, policies
+from services.policy import ChatPolicy
+from .admin import is_admin
+
+TIME_RE = re.compile(r'^([01]?\d|2[0-3]):[0-5]\d$')
+
+
+def describe(policy: ChatPolicy) -> str:
+    links = "запрещены" if policy.block_links else "разрешены"
+    joins = (
+        f"больше {policy.join_raid_limit} входов за {policy.join_raid_window_seconds:g} сек."
+        if policy.join_raid_limit else "не отслеживается"
+    )
+    raid = (
+        f"одинаковый текст от {policy.duplicate_min_users} пользователей за "
+        f"{policy.duplicate_window_seconds:g} сек." if policy.duplicate_min_users else "не отслеживаются"
+    )
+    return (
+        f"⚙️ Правила чата (версия {policy.version}):\n"
+        f"• Спам: {policy.spam_message_limit} сообщений за {policy.spam_time_window_seconds:g} сек., "
+        f"мут на {policy.spam_mute_duration_hours:g} ч.\n"
+        f"• Рейды: {raid}\n"
+        f"• Наплыв участников: {joins}\n"
+        f"• Ссылки: {links}; разрешенные домены: {', '.join(sorted(policy.link_allowlist)) or 'нет'}; "
+        f"запрещенные: {', '.join(sorted(policy.link_denylist)) or 'нет'}\n"
+        f"• Свои стоп-слова: {len(policy.extra_words)}, исключено из общего списка: {len(policy.allowed_words)}\n"
+        f"• Ночной режим: с {policy.night_start} до {policy.night_end} ({policy.timezone})"
+    )
+
+
+async def _admin_only(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    if await is_admin(update, context):
+        return True
+    await update.message.reply_text("❌ Эта команда доступна только администраторам.")
+    return False
+
+
+async def show_policy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает правила модерации текущего чата."""
+    if not await _admin_only(update, context):
+        return
+    policy = await policies.get_policy(update.effective_chat.id)
+    await update.message.reply_text(describe(policy))
+
+
+async def set_spam(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Меняет пороги спам-фильтра.
+    Использование: /set_spam <сообщений> <секунд> [часов мута]
+    """
+    if not await _admin_only(update, context):
+        return
+    args = context.args or []
+    try:
+        limit, window = int(args[0]), float(args[1])
+        mute = float(args[2]) if len(args) > 2 else None
+        if limit < 2 or window <= 0 or (mute is not None and mute <= 0):
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Использование: /set_spam <сообщений (от 2)> <секунд> [часов мута]")
+        return
+    changes = {'spam_message_limit': limit, 'spam_time_window_seconds': window}
+    if mute is not None:
+        changes['spam_mute_duration_hours'] = mute
+    compiled = await policies.update(update.effective_chat.id, **changes)
+    await update.message.reply_text("✅ Пороги спам-фильтра обновлены.\n\n" + describe(compiled.policy))
+
+
+async def set_duplicates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Меняет порог поиска рейдов: сколько разных пользователей должны прислать
+    почти одинаковое сообщение за окно. Использование: /set_duplicates <пользователей> [секунд]
+    /set_duplicates 0 выключает проверку.
+    """
+    if not await _admin_only(update, context):
+        return
+    args = context.args or []
+    try:
+        users = int(args[0])
+        window = float(args[1]) if len(args) > 1 else None
+        if users < 0 or users == 1 or (window is not None and window <= 0):
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Использование: /set_duplicates <пользователей (от 2, 0 - выкл.)> [секунд]")
+        return
+    changes = {'duplicate_min_users': users}
+    if window is not None:
+        changes['duplicate_window_seconds'] = window
+    compiled = await policies.update(update.effective_chat.id, **changes)
+    await update.message.reply_text("✅ Порог поиска рейдов обновлен.\n\n" + describe(compiled.policy))
+
+
+async def set_join_raid(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Меняет порог наплыва новых участников: больше скольких входов за окно
+    считается рейдом. Использование: /set_join_raid <входов> [секунд]
+    /set_join_raid 0 выключает проверку.
+    """
+    if not await _admin_only(update, context):
+        return
+    args = context.args or []
+    try:
+        limit = int(args[0])
+        window = float(args[1]) if len(args) > 1 else None
+        if limit < 0 or (window is not None and window <= 0):
+            raise ValueError
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Использование: /set_join_raid <входов (0 - выкл.)> [секунд]")
+        return
+    changes = {'join_raid_limit': limit}
+    if window is not None:
+        changes['join_raid_window_seconds'] = window
+    compiled = await policies.update(update.effective_chat.id, **changes)
+    await update.message.reply_text("✅ Порог наплыва участников обновлен.\n\n" + describe(compiled.policy))
+
+
+async def add_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Добавляет стоп-слова только для этого чата. Использование: /add_words слово1 слово2 ..."""
+    if not await _admin_only(update, context):
+        return
+    words = {w.lower() for w in context.args or []}
+    if not words:
+        await update.message.reply_text("❌ Использование: /add_words слово1 слово2 ...")
+        return
+    policy = await policies.get_policy(update.effective_chat.id)
+    await policies.update(
+        update.effective_chat.id,
+        extra_words=policy.extra_words | words,
+        allowed_words=policy.allowed_words - words,
+    )
+    await update.message.reply_text(f"✅ Добавлено стоп-слов для чата: {len(words)}.")
+
+
+async def allow_words(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Разрешает слова в этом чате (в том числе из общего списка). Использование: /allow_words слово1 ..."""
+    if not await _admin_only(update, context):
+        return
+    words = {w.lower() for w in context.args or []}
+    if not words:
+        await update.message.reply_text("❌ Использование: /allow_words слово1 слово2 ...")
+        return
+    policy = await policies.get_policy(update.effective_chat.id)
+    await policies.update(
+        update.effective_chat.id,
+        extra_words=policy.extra_words - words,
+        allowed_words=policy.allowed_words | words,
+    )
+    await update.message.reply_text(f"✅ Слов разрешено в этом чате: {len(words)}.")
+
+
+async def set_links(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Включает или выключает удаление ссылок. Использование: /links on|off"""
+    if not await _admin_only(update, context):
+        return
+    arg = (context.args or [''])[0].lower()
+    if arg not in ('on', 'off'):
+        await update.message.reply_text("❌ Использование: /links on (удалять ссылки) или /links off")
+        return
+    await policies.update(update.effective_chat.id, block_links=(arg == 'on'))
+    await update.message.reply_text("✅ Ссылки теперь " + ("удаляются." if arg == 'on' else "разрешены."))
+
+
+async def _edit_domains(update: Update, context: ContextTypes.DEFAULT_TYPE, name: str, command: str, title: str):
+    """Добавляет домены в список name политики; домен с минусом впереди удаляется."""
+    if not await _admin_only(update, context):
+        return
+    if not context.args:
+        await update.message.reply_text(f"❌ Использование: /{command} домен1 -домен2 ...")
+        return
+    add = {d.lower().strip('.') for d in context.args if not d.startswith('-')}
+    remove = {d[1:].lower().strip('.') for d in context.args if d.startswith('-')}
+    policy = await policies.get_policy(update.effective_chat.id)
+    compiled = await policies.update(update.effective_chat.id, **{name: (getattr(policy, name) | add) - remove})
+    domains = getattr(compiled.policy, name)
+    await update.message.reply_text(f"✅ {title}: {', '.join(sorted(domains)) or 'нет'}.")
+
+
+async def allow_domains(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Добавляет домены в список разрешенных (вместе с поддоменами).
+    Домен с минусом впереди удаляется из списка: /allow_domains youtube.com -example.com
+    """
+    await _edit_domains(update, context, 'link_allowlist', 'allow_domains', "Разрешенные домены")
+
+
+async def deny_domains(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Добавляет домены в список запрещенных: ссылки на них удаляются, даже если
+    ссылки в чате разрешены. Более точное правило важнее: /deny_domains ads.youtube.com
+    запрещает поддомен, даже если youtube.com разрешен.
+    """
+    await _edit_domains(update, context, 'link_denylist', 'deny_domains', "Запрещенные домены")
+
+
+async def night_hours(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Меняет часы ночного режима чата.
+    Использование: /night_hours 23:00 08:00 [Europe/Moscow]
+    """
+    if not await _admin_only(update, context):
+        return
+    args = context.args or []
+    if len(args) < 2 or not TIME_RE.match(args[0]) or not TIME_RE.match(args[1]):
+        await update.message.reply_text("❌ Использование: /night_hours ЧЧ:ММ ЧЧ:ММ [часовой пояс]")
+        return
+    changes = {'night_start': args[0].zfill(5), 'night_end': args[1].zfill(5)}
+    if len(args) > 2:
+        if args[2] not in pytz.all_timezones_set:
+            await update.message.reply_text(f"❌ Неизвестный часовой пояс: {args[2]}")
+            return
+        changes['timezone'] = args[2]
+
+    chat_id = update.effective_chat.id
+    compiled = await policies.update(chat_id, **changes)
+    # Если ночной режим уже включен, переводим чат на новое расписание
+    if chat_id in bot_state.night_mode_chats:
+        night_scheduler.add(chat_id, compiled.policy)
+        await night_scheduler.sync_chat(chat_id)
+    await update.message.reply_text("✅ Часы ночного режима обновлены.\n\n" + describe(compiled.policy))
+
+
+async def reset_policy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Возвращает чату общие правила."""
+    if not await _admin_only(update, context):
+        return
+    chat_id = update.effective_chat.id
+    compiled = await policies.reset(chat_id)
+    if chat_id in bot_state.night_mode_chats:
+        night_scheduler.add(chat_id, compiled.policy)
+        await night_scheduler.sync_chat(chat_id)
+    await update.message.reply_text("✅ Для чата снова действуют общие правила.\n\n" + describe(compiled.policy))
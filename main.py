@@ -1,9 +1,21 @@
+import asyncio
 import logging
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+import secrets
+from telegram import Update
+from telegram.ext import ApplicationBuilder, ChatMemberHandler, CommandHandler, MessageHandler, filters
 
 # Импортируем наши настройки и обработчики
 import config
-from handlers import common, moderation, admin, night_mode
+from handlers import common, moderation, admin, night_mode, policy
+from services import metrics
+from services.persistence import StoragePersistence
+from services.rules import RuleSet
+from services.update_processor import PerChatUpdateProcessor
+
+# Фоновая загрузка теневых правил и чатов с ночным режимом (ссылки нужны,
+# чтобы задачи не собрал сборщик мусора)
+shadow_loading = None
+night_loading = None
 
 # Настройка логирования
 logging.basicConfig(
@@ -11,31 +23,116 @@ logging.basicConfig(
     level=logging.INFO
 )
 
-def main():
-    # Создаем приложение
-    application = ApplicationBuilder().token(config.BOT_TOKEN).build()
+async def load_shadow_rules():
+    """Теневые правила загружаются в фоне, как и основной список; до этого теневой режим молчит."""
+    try:
+        config.shadow_rules = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: RuleSet.load(
+                'shadow', config.SHADOW_WORDS_FILE or config.STOPWORDS_FILE, config.SHADOW_POLICY_FILE or None,
+                cache_size=config.POLICY_CACHE_SIZE, cache_dir=config.MATCHER_CACHE_DIR or None,
+            )
+        )
+    except Exception as e:
+        logging.error(f"Не удалось загрузить теневые правила: {e}")
+
+async def restore_night_mode():
+    """
+    Подключает к планировщику чаты с ночным режимом, сохраненные до перезапуска.
+    Политика каждого чата - отдельное чтение из хранилища, поэтому это идет
+    в фоне; пропущенные переходы планировщик догоняет сразу после загрузки.
+    """
+    try:
+        chats = {}
+        for chat_id in list(config.bot_state.night_mode_chats):
+            # В шардированном режиме чатом занимается только его воркер
+            if config.bot_state.owns(chat_id):
+                chats[chat_id] = await config.policies.get_policy(chat_id)
+        # Пока читали политики, ночной режим могли выключить командой
+        chats = {chat_id: policy for chat_id, policy in chats.items() if chat_id in config.bot_state.night_mode_chats}
+        await config.night_scheduler.restore(chats)
+    except Exception as e:
+        logging.error(f"Не удалось восстановить ночной режим: {e}")
+
+async def on_startup(application):
+    global shadow_loading, night_loading
+    # Стоп-слова читаются в фоне: обновления принимаются сразу, а проверка
+    # первых сообщений дождется загрузки (см. PolicyRegistry.get)
+    config.word_lists.load_in_background()
+    if config.SHADOW_WORDS_FILE or config.SHADOW_POLICY_FILE:
+        shadow_loading = asyncio.ensure_future(load_shadow_rules())
+    config.outbound.start(application.bot)
+    if config.METRICS_PORT:
+        await config.metrics_server.start()
+    if config.WORDS_WATCH:
+        config.word_lists.start()
+
+    # Восстанавливаем ночной режим для чатов, сохраненных до перезапуска:
+    # список чатов нужен проверке сообщений сразу, а их расписания подключаются в фоне
+    await config.bot_state.load()
+    config.night_scheduler.start(application.job_queue)
+    night_loading = asyncio.ensure_future(restore_night_mode())
 
-    # --- Регистрируем обработчики ---
+async def on_stop(application):
+    # Отправляем то, что еще осталось в очереди, пока бот еще может делать запросы.
+    # Незаконченные переходы ночного режима догонятся после перезапуска.
+    if night_loading is not None and not night_loading.done():
+        night_loading.cancel()
+    await config.night_scheduler.stop()
+    await config.outbound.stop()
+    await config.metrics_server.stop()
+    await config.word_lists.stop()
+
+async def on_shutdown(application):
+    # PTB уже передал chat_data в хранилище, осталось записать и закрыть базу
+    await config.storage.close()
+
+def default_builder():
+    """ApplicationBuilder с токеном и сетевым клиентом, который пишет метрики Bot API."""
+    return (
+        ApplicationBuilder()
+        .token(config.BOT_TOKEN)
+        .request(metrics.InstrumentedRequest(connection_pool_size=256))
+    )
+
+def build_application(builder=None):
+    """
+    Создает приложение со всеми обработчиками бота.
+    Свой builder передают бенчмарки, чтобы подменить сеть.
+    """
+    if builder is None:
+        builder = default_builder()
+    application = (
+        builder
+        .persistence(StoragePersistence(config.storage, update_interval=config.PERSISTENCE_UPDATE_SECONDS))
+        .concurrent_updates(PerChatUpdateProcessor(config.CONCURRENT_UPDATES))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
+    register_handlers(application)
+    return application
+
+def register_handlers(application):
+    """Регистрирует обработчики команд и событий."""
 
     # Общие команды
     application.add_handler(CommandHandler('start', common.start))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, common.welcome))
 
-    # Модерация
-    application.add_handler(MessageHandler(
-        filters.TEXT & (~filters.COMMAND),
-        moderation.filter_messages,
-        block=False # block=False позволяет другим обработчикам тоже сработать, если нужно
-    ))
-    '''application.add_handler(MessageHandler(
-        filters.TEXT & (~filters.COMMAND),
-        moderation.filter_messages
-    ))'''
+    # Авторы всех сообщений (и стикеров, голосовых, медиа без подписи) для
+    # пакетных команд; группа -1 выполняется до остальных обработчиков
+    application.add_handler(MessageHandler(filters.ALL, admin.record_message), group=-1)
 
+    # Модерация: один обработчик на текст, подписи к медиа, правки и пересылки.
+    # Пересылки проверяются всегда, даже если текст начинается с "/".
+    # Параллельность дает PerChatUpdateProcessor (разные чаты обрабатываются
+    # одновременно), а block=True сохраняет порядок сообщений внутри чата.
     application.add_handler(MessageHandler(
-        filters.FORWARDED,
-        moderation.delete_forwarded_messages
+        filters.FORWARDED | ((filters.TEXT | filters.CAPTION) & ~filters.COMMAND),
+        moderation.filter_messages
     ))
+
     # Ночной режим
     application.add_handler(CommandHandler('night_mode_on', night_mode.night_mode_on))
     application.add_handler(CommandHandler('night_mode_off', night_mode.night_mode_off))
@@ -45,11 +142,60 @@ def main():
     application.add_handler(CommandHandler('ban', admin.ban_user))
     application.add_handler(CommandHandler('mute', admin.mute_user))
     application.add_handler(CommandHandler('unmute', admin.unmute_user))
+    application.add_handler(CommandHandler('ban_range', admin.ban_range))
+    application.add_handler(CommandHandler('mute_range', admin.mute_range))
+    application.add_handler(CommandHandler('ban_flagged', admin.ban_flagged))
     application.add_handler(CommandHandler('reload_words', admin.reload_words))
+    application.add_handler(CommandHandler('cache_stats', admin.cache_stats))
+    application.add_handler(CommandHandler('raid_release', admin.release_raid))
+
+    # Правила модерации чата
+    application.add_handler(CommandHandler('policy', policy.show_policy))
+    application.add_handler(CommandHandler('set_spam', policy.set_spam))
+    application.add_handler(CommandHandler('set_duplicates', policy.set_duplicates))
+    application.add_handler(CommandHandler('set_join_raid', policy.set_join_raid))
+    application.add_handler(CommandHandler('add_words', policy.add_words))
+    application.add_handler(CommandHandler('allow_words', policy.allow_words))
+    application.add_handler(CommandHandler('links', policy.set_links))
+    application.add_handler(CommandHandler('allow_domains', policy.allow_domains))
+    application.add_handler(CommandHandler('deny_domains', policy.deny_domains))
+    application.add_handler(CommandHandler('night_hours', policy.night_hours))
+    application.add_handler(CommandHandler('policy_reset', policy.reset_policy))
+
+    # Изменения прав участников сбрасывают кэш администраторов
+    application.add_handler(ChatMemberHandler(admin.track_chat_members, ChatMemberHandler.ANY_CHAT_MEMBER))
+
+    # Счетчики вызовов и время работы каждого обработчика (см. /metrics)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = metrics.instrument(handler.callback.__name__)(handler.callback)
+
+def main():
+    if config.SHARD_WORKERS > 0:
+        # Импорт здесь: sharded сам импортирует main для сборки воркеров
+        import sharded
+        sharded.run(config.SHARD_WORKERS)
+        return
+
+    application = build_application()
 
     # Запускаем бота
     print("Бот запущен...")
-    application.run_polling()
+    # chat_member не приходят по умолчанию, поэтому запрашиваем все типы обновлений
+    if config.BOT_MODE == 'webhook':
+        if not config.WEBHOOK_URL:
+            raise SystemExit("Для BOT_MODE=webhook нужно задать WEBHOOK_URL")
+        # Запросы без правильного секрета в заголовке PTB отклоняет сам
+        application.run_webhook(
+            listen=config.WEBHOOK_LISTEN,
+            port=config.WEBHOOK_PORT,
+            url_path=config.WEBHOOK_PATH,
+            webhook_url=f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}",
+            secret_token=config.WEBHOOK_SECRET or secrets.token_urlsafe(32),
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
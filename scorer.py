@@ -0,0 +1,270 @@
+"""
+Офлайн-оценка правил модерации на выгрузках чатов Telegram.
+
+Выгрузка - JSON из Telegram Desktop ("Экспорт истории чата", формат JSON),
+по файлу на чат. Каждое сообщение проходит те же проверки, что и в боте
+(handlers.moderation.evaluate: спам-фильтр, пересылки, рейды, стоп-слова,
+ссылки), но без сети: ничего не удаляется, выводится отчет - что было бы
+удалено и кто лишился бы права голоса. Время сообщений берется из выгрузки,
+поэтому спам-фильтры видят ту же картину, что бот видел бы вживую.
+
+С --candidate-words / --candidate-policy правила оцениваются в двух версиях
+за один проход, и в отчет попадает разница между ними.
+
+Файлы читаются потоково (в памяти одно сообщение, а не вся выгрузка) и
+распределяются по процессам: один чат проверяется целиком в одном процессе,
+по порядку - от порядка зависят спам-фильтр и поиск рейдов.
+
+Запуск из корня проекта:
+    python scorer.py export.json
+    python scorer.py chats/*.json --candidate-words new_stopwords.txt --output decisions.jsonl
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+# Оценка не должна трогать рабочую базу, порт метрик и файлы работающего бота
+os.environ.setdefault('BOT_DB_PATH', ':memory:')
+os.environ.setdefault('METRICS_PORT', '0')
+os.environ.setdefault('WORDS_WATCH', '0')
+
+from telegram import MessageEntity  # noqa: E402
+
+import config  # noqa: E402
+from handlers.moderation import MUTING, RAID, Inspection, evaluate  # noqa: E402
+from services.matcher import WordMatcher  # noqa: E402
+from services.rules import RuleSet  # noqa: E402
+
+_MESSAGES_START = re.compile(r'"messages"\s*:\s*\[')
+_CHAT_ID = re.compile(r'"id"\s*:\s*(-?\d+)')
+_FROM_ID = re.compile(r'^(user|channel|chat)?(\d+)$')
+# Типы фрагментов текста в выгрузке, которые в Bot API были бы ссылками
+_ENTITY_TYPES = {'link': MessageEntity.URL, 'text_link': MessageEntity.TEXT_LINK}
+PASS = 'pass'
+
+# Версии правил процесса-воркера: [действующие, кандидат]
+_rules: List[RuleSet] = []
+_admins: Set[int] = set()
+
+
+class FileReport(NamedTuple):
+    path: str
+    chat_id: int
+    messages: int
+    seconds: float
+    # По версиям правил: message_id -> (решение, подробности, автор)
+    decided: List[Dict[int, Tuple[str, str, int]]]
+    muted: List[Set[int]]
+    # Начало текста для сообщений, по которым хоть одна версия что-то решила
+    texts: Dict[int, str]
+
+
+# --- Чтение выгрузки ---
+
+def iter_export(path: str, chunk_size: int = 1 << 20) -> Iterator[Tuple[int, dict]]:
+    """
+    Сообщения выгрузки по одному: (id чата, сообщение). Файл читается
+    кусками, массив messages разбирается по элементам, без загрузки целиком.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            buffer += chunk
+            match = _MESSAGES_START.search(buffer)
+            if match:
+                break
+        header = _CHAT_ID.search(buffer, 0, match.start())
+        chat_id = int(header.group(1)) if header else 0
+        buffer, position = buffer[match.end():], 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                if position >= len(buffer):
+                    raise ValueError
+                message, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # Сообщение не поместилось в прочитанный кусок
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise ValueError(f"{path}: выгрузка обрывается внутри messages")
+                buffer, position = buffer[position:] + chunk, 0
+                continue
+            yield chat_id, message
+
+
+def _user_id(from_id) -> int:
+    match = _FROM_ID.match(str(from_id or ''))
+    if not match:
+        return 0
+    return -int(match.group(2)) if match.group(1) in ('channel', 'chat') else int(match.group(2))
+
+
+def to_inspection(rules: RuleSet, chat_id: int, raw: dict) -> Optional[Inspection]:
+    """Сообщение выгрузки в том виде, в каком его проверяет бот; служебные сообщения пропускаются."""
+    if raw.get('type') != 'message':
+        return None
+    parts = raw.get('text_entities')
+    if parts is None:
+        text = raw.get('text', '')
+        parts = [p if isinstance(p, dict) else {'type': 'plain', 'text': p}
+                 for p in (text if isinstance(text, list) else [text])]
+    text, entities = '', {}
+    for part in parts:
+        part_text = part.get('text', '')
+        entity_type = _ENTITY_TYPES.get(part.get('type'))
+        if entity_type:
+            entity = MessageEntity(entity_type, len(text), len(part_text), url=part.get('href'))
+            entities[entity] = part_text
+        text += part_text
+    return Inspection(
+        rules.compiled(chat_id, config.default_policy), chat_id, raw['id'], _user_id(raw.get('from_id')), text,
+        author=raw.get('from') or "Пользователь",
+        forwarded='forwarded_from' in raw,
+        entities=entities or None,
+        now=float(raw.get('date_unixtime') or 0),
+    )
+
+
+def inspections(path: str) -> Iterator[Inspection]:
+    for chat_id, raw in iter_export(path):
+        item = to_inspection(_rules[0], chat_id, raw)
+        # Администраторы в боте не проверяются
+        if item is not None and item.user_id not in _admins:
+            yield item
+
+
+# --- Оценка ---
+
+def _init_worker(rule_specs: List[Tuple[str, Dict, WordMatcher]], admins: Set[int]):
+    global _rules, _admins
+    # Автоматы построены (или прочитаны из кэша) в основном процессе и приходят
+    # готовыми: распаковать их намного быстрее, чем строить в каждом воркере
+    _rules = [RuleSet(name, matcher.words, overrides, matcher=matcher) for name, overrides, matcher in rule_specs]
+    _admins = admins
+
+
+def score_file(path: str) -> FileReport:
+    """Прогоняет один чат через все версии правил. Выполняется в процессе-воркере."""
+    started = time.perf_counter()
+    states = [{} for _ in _rules]
+    decided = [{} for _ in _rules]
+    muted = [set() for _ in _rules]
+    texts = {}
+    count, chat_id = 0, 0
+    for item in inspections(path):
+        count += 1
+        chat_id = item.chat_id
+        for index, rules in enumerate(_rules):
+            current = item if index == 0 else item.with_policy(rules.compiled(item.chat_id, config.default_policy))
+            verdict = evaluate(states[index], current, timed=False)
+            if verdict is None:
+                continue
+            texts[item.message_id] = item.text[:200]
+            if verdict.reason == RAID:
+                # Рейд удаляет и накопленные сообщения кластера, и мутит всех его участников
+                for user_id, message_id in verdict.raid.messages:
+                    decided[index][message_id] = (RAID, '', user_id)
+                muted[index].update(verdict.raid.users)
+            else:
+                decided[index][item.message_id] = (verdict.reason, verdict.detail, item.user_id)
+                if verdict.reason in MUTING:
+                    muted[index].add(item.user_id)
+    return FileReport(path, chat_id, count, time.perf_counter() - started, decided, muted, texts)
+
+
+def run(paths: List[str], rule_specs, admins: Set[int], workers: int) -> Iterator[FileReport]:
+    if workers <= 1 or len(paths) == 1:
+        _init_worker(rule_specs, admins)
+        yield from map(score_file, paths)
+        return
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(min(workers, len(paths)), initializer=_init_worker, initargs=(rule_specs, admins)) as pool:
+        yield from pool.imap_unordered(score_file, paths)
+
+
+# --- Отчет ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Офлайн-оценка правил модерации на выгрузках чатов")
+    parser.add_argument('exports', nargs='+', help='JSON-выгрузки чатов из Telegram Desktop')
+    parser.add_argument('--words', default=config.STOPWORDS_FILE, help='стоп-слова действующих правил')
+    parser.add_argument('--policy', help='JSON с поправками к политике для действующих правил')
+    parser.add_argument('--candidate-words', help='стоп-слова правил-кандидата')
+    parser.add_argument('--candidate-policy', help='JSON с поправками к политике для правил-кандидата')
+    parser.add_argument('--admins', default='', help='id администраторов через запятую (их сообщения не проверяются)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='число процессов')
+    parser.add_argument('--output', help='записать решения по сообщениям в JSON Lines')
+    parser.add_argument('--examples', type=int, default=10, help='сколько расхождений показать')
+    args = parser.parse_args(argv)
+
+    # Файлы правил читаются здесь один раз: воркерам передаются поправки и готовые автоматы
+    cache_dir = config.MATCHER_CACHE_DIR or None
+    versions = [RuleSet.load('active', args.words, args.policy, cache_dir=cache_dir)]
+    if args.candidate_words or args.candidate_policy:
+        versions.append(RuleSet.load('candidate', args.candidate_words or args.words, args.candidate_policy,
+                                     cache_dir=cache_dir))
+    rule_specs = [(rules.name, rules.overrides, rules.matcher) for rules in versions]
+    admins = {int(a) for a in args.admins.split(',') if a.strip()}
+    names = [rules.name for rules in versions]
+
+    started = time.perf_counter()
+    total = 0
+    reasons = [Counter() for _ in rule_specs]
+    muted = [0 for _ in rule_specs]
+    transitions = Counter()
+    examples = []
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        for report in run(args.exports, rule_specs, admins, args.workers):
+            total += report.messages
+            rate = report.messages / report.seconds if report.seconds else 0
+            print(f"{report.path}: {report.messages:,} сообщений, {report.seconds:.2f} с ({rate:,.0f}/с)")
+            for index, decided in enumerate(report.decided):
+                reasons[index].update(reason for reason, _, _ in decided.values())
+                muted[index] += len(report.muted[index])
+            for message_id in sorted(set().union(*report.decided)):
+                verdicts = [decided.get(message_id) for decided in report.decided]
+                row = {'file': report.path, 'chat_id': report.chat_id, 'message_id': message_id,
+                       'user_id': next(v[2] for v in verdicts if v), 'text': report.texts.get(message_id, '')}
+                for name, verdict in zip(names, verdicts):
+                    row[name] = verdict[0] if verdict else PASS
+                    if verdict and verdict[1]:
+                        row[f'{name}_detail'] = verdict[1]
+                if len(verdicts) > 1 and row[names[0]] != row[names[1]]:
+                    transitions[(row[names[0]], row[names[1]])] += 1
+                    if len(examples) < args.examples:
+                        examples.append(row)
+                if output:
+                    output.write(json.dumps(row, ensure_ascii=False) + '\n')
+    finally:
+        if output:
+            output.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"\nСообщений: {total:,}, файлов: {len(args.exports)}, {elapsed:.2f} с ({total / elapsed:,.0f} сообщений/с)")
+    for name, counter, count in zip(names, reasons, muted):
+        details = ", ".join(f"{reason} — {n:,}" for reason, n in counter.most_common()) or "нет"
+        print(f"{name}: удалено {sum(counter.values()):,} ({details}); лишены права голоса: {count:,}")
+    if len(names) > 1:
+        print(f"\nРасхождения {names[0]} -> {names[1]}: {sum(transitions.values()):,}")
+        for (before, after), n in transitions.most_common():
+            print(f"  {before} -> {after}: {n:,}")
+        for row in examples:
+            print(f"  [{row['message_id']}] {row[names[0]]} -> {row[names[1]]}: {row['text'][:80]!r}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Tuple
+
+from telegram import Bot
+
+
+class AdminCache:
+    """
+    Кэш списков администраторов по чатам.
+
+    Список чата загружается одним вызовом get_chat_administrators и живет
+    ttl секунд. Хранится не больше max_chats чатов: при переполнении
+    вытесняется тот, к которому дольше всего не обращались.
+    """
+
+    def __init__(self, ttl: float, max_chats: int):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self.hits = 0
+        self.misses = 0
+        # chat_id -> (момент устаревания по time.monotonic(), id администраторов)
+        self._entries: "OrderedDict[int, Tuple[float, FrozenSet[int]]]" = OrderedDict()
+        # Загрузки, которые уже идут: параллельные сообщения из холодного чата
+        # ждут один и тот же запрос, а не делают каждый свой
+        self._pending: Dict[int, asyncio.Task] = {}
+
+    async def get_admins(self, bot: Bot, chat_id: int) -> FrozenSet[int]:
+        """Возвращает id администраторов чата, при необходимости загружая их."""
+        entry = self._entries.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            self._entries.move_to_end(chat_id)
+            return entry[1]
+
+        self.misses += 1
+        task = self._pending.get(chat_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(bot, chat_id))
+            self._pending[chat_id] = task
+            task.add_done_callback(lambda _: self._pending.pop(chat_id, None))
+        return await asyncio.shield(task)
+
+    async def is_admin(self, bot: Bot, chat_id: int, user_id: int) -> bool:
+        return user_id in await self.get_admins(bot, chat_id)
+
+    async def _load(self, bot: Bot, chat_id: int) -> FrozenSet[int]:
+        members = await bot.get_chat_administrators(chat_id)
+        admins = frozenset(member.user.id for member in members)
+        self._entries[chat_id] = (time.monotonic() + self.ttl, admins)
+        self._entries.move_to_end(chat_id)
+        while len(self._entries) > self.max_chats:
+            self._entries.popitem(last=False)
+        return admins
+
+    def invalidate(self, chat_id: int):
+        """Сбрасывает список чата: следующая проверка загрузит его заново."""
+        self._entries.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'chats': len(self._entries),
+        }
@@ -0,0 +1,218 @@
+import itertools
+import random
+import time
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Размер отпечатка (число хеш-функций MinHash) и его деление на полосы для индекса
+SKETCH_SIZE = 8
+BANDS = 4
+ROWS = SKETCH_SIZE // BANDS
+# Сколько позиций отпечатков должно совпасть, чтобы сообщения считались одинаковыми
+# (оценка сходства Жаккара не ниже MATCH_THRESHOLD / SKETCH_SIZE)
+MATCH_THRESHOLD = 6
+# Длина шингла в символах нормализованного текста; более короткие тексты не проверяются
+SHINGLE = 4
+# Сколько последних сообщений помнит одна корзина индекса; защищает от
+# частых шаблонов, на которые иначе пришлось бы проверять все окно
+BUCKET_LIMIT = 32
+
+_MASK = (1 << 61) - 1
+_rng = random.Random(20240601)
+# Хеш-функции MinHash вида (a * h + b) mod 2^61
+_PERMUTATIONS = [(_rng.getrandbits(61) | 1, _rng.getrandbits(61)) for _ in range(SKETCH_SIZE)]
+
+
+def fingerprint(normalized: str) -> Tuple[int, ...]:
+    """
+    Отпечаток нормализованного текста (MinHash по символьным шинглам):
+    для каждой из SKETCH_SIZE хеш-функций - минимальный хеш шингла.
+    Позиция отпечатков двух текстов совпадает с вероятностью, равной
+    сходству Жаккара их множеств шинглов.
+    """
+    text = ' '.join(normalized.split())
+    hashes = [hash(text[i:i + SHINGLE]) for i in range(len(text) - SHINGLE + 1)]
+    if not hashes:
+        return ()
+    return tuple(min([(a * h + b) & _MASK for h in hashes]) for a, b in _PERMUTATIONS)
+
+
+def _bands(sketch: Tuple[int, ...]):
+    return [(band, sketch[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+
+class _Cluster:
+    """
+    Группа почти одинаковых сообщений в окне. Хранит только живые сообщения
+    (stamp, автор, message_id): они уходят из кластера вместе с записями окна,
+    поэтому порог считается по авторам внутри window, а не по цепочке окон.
+    """
+
+    __slots__ = ('live', 'users', 'reported', 'flagged')
+
+    def __init__(self):
+        self.live: "deque[Tuple[float, int, int]]" = deque()
+        # Автор -> сколько его сообщений в окне
+        self.users: Dict[int, int] = {}
+        # Сообщения, уже отданные в Raid (повторно их удалять не нужно)
+        self.reported = set()
+        self.flagged = False
+
+    def add(self, stamp: float, user_id: int, message_id: int):
+        self.live.append((stamp, user_id, message_id))
+        self.users[user_id] = self.users.get(user_id, 0) + 1
+
+    def drop_oldest(self, min_users: int):
+        _, user_id, message_id = self.live.popleft()
+        self.reported.discard(message_id)
+        if self.users[user_id] == 1:
+            del self.users[user_id]
+        else:
+            self.users[user_id] -= 1
+        # Рейд закончился: новый кластер снова должен набрать порог
+        if len(self.users) < min_users:
+            self.flagged = False
+
+
+class _Entry(NamedTuple):
+    stamp: float
+    sketch: Tuple[int, ...]
+    cluster: _Cluster
+
+
+class Raid(NamedTuple):
+    """
+    Что сделать с кластером: удалить сообщения и наказать пользователей.
+    new=True - кластер только что превысил порог (в нем все накопленное),
+    иначе это очередное сообщение уже найденного рейда.
+    """
+    messages: List[Tuple[int, int]]
+    users: List[int]
+    new: bool
+
+
+class DuplicateDetector:
+    """
+    Поиск одинаковых сообщений от разных пользователей в одном чате.
+
+    Каждое сообщение за последние window секунд хранится как отпечаток
+    (см. fingerprint) в индексе по полосам отпечатка (LSH). Проверка нового
+    сообщения - это BANDS обращений к словарю и сверка нескольких
+    кандидатов, независимо от того, сколько сообщений в окне. Похожие
+    сообщения собираются в кластер; когда в нем набирается min_users
+    разных пользователей, детектор возвращает весь кластер разом.
+    Память ограничена max_entries сообщениями на чат; тексты короче
+    min_length символов (после нормализации) не учитываются.
+    """
+
+    __slots__ = ('min_users', 'window', 'min_length', 'max_entries', '_entries', '_buckets', '_ids')
+
+    def __init__(self, min_users: int, window: float, min_length: int = 30, max_entries: int = 2000):
+        self.min_users = min_users
+        self.window = window
+        self.min_length = min_length
+        self.max_entries = max_entries
+        self._entries: "deque[Tuple[int, _Entry]]" = deque()
+        self._buckets: Dict[tuple, deque] = {}
+        self._ids = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def check(self, normalized: str, user_id: int, message_id: int,
+              now: Optional[float] = None) -> Optional[Raid]:
+        """Учитывает сообщение. Возвращает Raid, если его кластер надо наказать."""
+        if now is None:
+            now = time.monotonic()
+        self._expire(now)
+        # Короткие ответы ("привет", "+1") совпадают у всех и рейдом не считаются
+        if len(normalized) < self.min_length:
+            return None
+        sketch = fingerprint(normalized)
+        if not sketch:
+            return None
+
+        cluster = self._lookup(sketch)
+        if cluster is None:
+            cluster = _Cluster()
+        # Сначала в кластер, потом в окно: вытеснение из окна убирает самое старое сообщение кластера
+        cluster.add(now, user_id, message_id)
+        self._add(_Entry(now, sketch, cluster))
+
+        if cluster.flagged:
+            cluster.reported.add(message_id)
+            return Raid([(user_id, message_id)], [user_id], False)
+        if len(cluster.users) >= self.min_users:
+            cluster.flagged = True
+            messages = [(user, message) for _, user, message in cluster.live if message not in cluster.reported]
+            cluster.reported.update(message for _, message in messages)
+            return Raid(messages, sorted(cluster.users), True)
+        return None
+
+    def _lookup(self, sketch: Tuple[int, ...]) -> Optional[_Cluster]:
+        # Кандидаты - сообщения, совпавшие хотя бы в одной полосе; затем сверяем отпечатки целиком
+        candidates = set()
+        for key in _bands(sketch):
+            candidates.update(self._buckets.get(key, ()))
+        best, best_score = None, MATCH_THRESHOLD - 1
+        for entry_id in candidates:
+            entry = self._entry(entry_id)
+            if entry is None:
+                continue
+            score = sum(a == b for a, b in zip(sketch, entry.sketch))
+            if score > best_score:
+                best, best_score = entry, score
+        return best.cluster if best else None
+
+    def _entry(self, entry_id: int) -> Optional[_Entry]:
+        # Записи лежат по возрастанию id, ищем двоичным поиском
+        entries = self._entries
+        low, high = 0, len(entries)
+        while low < high:
+            middle = (low + high) // 2
+            if entries[middle][0] < entry_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(entries) and entries[low][0] == entry_id:
+            return entries[low][1]
+        return None
+
+    def _add(self, entry: _Entry):
+        entry_id = next(self._ids)
+        self._entries.append((entry_id, entry))
+        for key in _bands(entry.sketch):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = deque(maxlen=BUCKET_LIMIT)
+            bucket.append(entry_id)
+        if len(self._entries) > self.max_entries:
+            self._pop()
+
+    def _expire(self, now: float):
+        while self._entries and now - self._entries[0][1].stamp >= self.window:
+            self._pop()
+
+    def _pop(self):
+        entry_id, entry = self._entries.popleft()
+        # Записи уходят в порядке добавления, и в кластере эта запись тоже самая старая
+        entry.cluster.drop_oldest(self.min_users)
+        for key in _bands(entry.sketch):
+            bucket = self._buckets.get(key)
+            # Записи уходят в порядке добавления, поэтому удаляемая - первая в корзине
+            # (если корзина уже не вытеснила ее сама)
+            if bucket and bucket[0] == entry_id:
+                bucket.popleft()
+            if bucket is not None and not bucket:
+                del self._buckets[key]
+
+    def __getstate__(self):
+        # Отпечатки зависят от hash() процесса и нужны только в пределах окна,
+        # поэтому сохраняются лишь настройки
+        return self.min_users, self.window, self.min_length, self.max_entries
+
+    def __setstate__(self, state):
+        self.min_users, self.window, self.min_length, self.max_entries = state
+        self._entries = deque()
+        self._buckets = {}
+        self._ids = itertools.count()
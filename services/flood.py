@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+
+class FloodDetector:
+    """
+    Скользящее окно сообщений для одного чата.
+
+    Для каждого пользователя хранится кольцевой буфер из последних limit
+    меток времени (time.monotonic()). Флуд - это limit сообщений за window
+    секунд, то есть самая старая метка в заполненном буфере моложе окна.
+    Пользователи упорядочены по последней активности: те, кто молчит дольше
+    окна, вытесняются с начала очереди, а общее число отслеживаемых
+    пользователей не превышает max_users.
+    """
+
+    __slots__ = ('limit', 'window', 'max_users', '_users')
+
+    def __init__(self, limit: int, window: float, max_users: int):
+        self.limit = limit
+        self.window = window
+        self.max_users = max_users
+        self._users: "OrderedDict[int, deque]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def hit(self, user_id: int, now: Optional[float] = None) -> bool:
+        """Учитывает сообщение пользователя. Возвращает True, если это флуд."""
+        if now is None:
+            now = time.monotonic()
+        users = self._users
+
+        # Выбрасываем пользователей, чье последнее сообщение уже вне окна
+        while users:
+            oldest = next(iter(users.values()))
+            if now - oldest[-1] < self.window:
+                break
+            users.popitem(last=False)
+
+        timestamps = users.get(user_id)
+        if timestamps is None:
+            timestamps = users[user_id] = deque(maxlen=self.limit)
+            if len(users) > self.max_users:
+                users.popitem(last=False)
+        else:
+            users.move_to_end(user_id)
+
+        timestamps.append(now)
+        return len(timestamps) == self.limit and now - timestamps[0] < self.window
+
+    def __getstate__(self):
+        # time.monotonic() не переживает перезагрузку машины, поэтому
+        # при сохранении переводим метки во время по часам
+        offset = time.time() - time.monotonic()
+        users = [(user_id, [ts + offset for ts in stamps]) for user_id, stamps in self._users.items()]
+        return self.limit, self.window, self.max_users, users
+
+    def __setstate__(self, state):
+        self.limit, self.window, self.max_users, users = state
+        offset = time.time() - time.monotonic()
+        self._users = OrderedDict(
+            (user_id, deque((ts - offset for ts in stamps), maxlen=self.limit)) for user_id, stamps in users
+        )
+
+    def reset(self, user_id: int):
+        """Забывает историю пользователя (например, после наказания)."""
+        self._users.pop(user_id, None)
@@ -0,0 +1,92 @@
+import time
+from collections import deque
+from typing import List, Optional, Set
+
+
+class JoinGuard:
+    """
+    Отслеживание наплыва новых участников (рейда) в одном чате.
+
+    Хранятся метки времени (и id) последних limit + 1 входов: если самая старая
+    из них моложе window секунд, за окно вошло больше limit участников и
+    начинается рейд. Рейд считается законченным, когда порог не превышался
+    calm секунд. Все, кто вошел во время рейда, попадают в wave - их
+    ограничения потом можно снять разом.
+    """
+
+    __slots__ = ('limit', 'window', 'calm', 'active', 'last_burst', 'pending', 'wave', '_joins')
+
+    def __init__(self, limit: int, window: float, calm: float):
+        self.limit = limit
+        self.window = window
+        self.calm = calm
+        self.active = False
+        self.last_burst = 0.0
+        # Сколько участников еще не получили сводное приветствие
+        self.pending = 0
+        self.wave: Set[int] = set()
+        self._joins: deque = deque(maxlen=limit + 1)
+
+    def configure(self, limit: int, window: float):
+        """Меняет пороги, не теряя участников текущей волны."""
+        if limit != self.limit:
+            self._joins = deque(self._joins, maxlen=limit + 1)
+        self.limit, self.window = limit, window
+
+    def joined(self, user_ids: List[int], now: Optional[float] = None) -> Optional[List[int]]:
+        """
+        Учитывает вошедших. Если в чате идет рейд, возвращает новых участников
+        волны, которых надо ограничить: при начале рейда это и те, кто вошел
+        чуть раньше в пределах окна. Без рейда возвращает None.
+        """
+        if now is None:
+            now = time.monotonic()
+        joins = self._joins
+        for user_id in user_ids:
+            joins.append((now, user_id))
+        added = list(user_ids)
+        if len(joins) == joins.maxlen and now - joins[0][0] < self.window:
+            if not self.active:
+                # Первые участники наплыва уже поприветствованы, но ограничить их тоже нужно
+                added = [user_id for _, user_id in joins]
+            self.active = True
+            self.last_burst = now
+        if not self.active:
+            return None
+        self.pending += len(user_ids)
+        added = [user_id for user_id in dict.fromkeys(added) if user_id not in self.wave]
+        self.wave.update(added)
+        return added
+
+    def calmed(self, now: Optional[float] = None) -> bool:
+        """Рейд идет, но порог не превышался уже calm секунд."""
+        if now is None:
+            now = time.monotonic()
+        return self.active and now - self.last_burst >= self.calm
+
+    def finish(self):
+        """Завершает рейд; участники волны остаются ограниченными до release()."""
+        self.active = False
+        self._joins.clear()
+
+    def release(self) -> List[int]:
+        """Завершает рейд и возвращает всех участников волны, забывая их."""
+        users = sorted(self.wave)
+        self.finish()
+        self.wave.clear()
+        self.pending = 0
+        return users
+
+    def __getstate__(self):
+        # Метки time.monotonic() переводятся во время по часам, как в FloodDetector
+        offset = time.time() - time.monotonic()
+        return (self.limit, self.window, self.calm, self.active, self.last_burst + offset,
+                self.pending, sorted(self.wave), [(ts + offset, user_id) for ts, user_id in self._joins])
+
+    def __setstate__(self, state):
+        limit, window, calm, active, last_burst, pending, wave, joins = state
+        offset = time.time() - time.monotonic()
+        self.limit, self.window, self.calm = limit, window, calm
+        self.active, self.last_burst, self.pending = active, last_burst - offset, pending
+        self.wave = set(wave)
+        self._joins = deque(((ts - offset, user_id) for ts, user_id in joins), maxlen=limit + 1)
@@ -0,0 +1,178 @@
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Вердикты по домену
+ALLOW, DENY, LOOKALIKE, UNKNOWN = 'allow', 'deny', 'lookalike', 'unknown'
+
+# Домены, подделки которых ловятся в любом чате, даже без списка разрешенных
+PROTECTED_DOMAINS = ('telegram.org', 'telegram.me', 't.me', 'telegra.ph')
+
+# Кириллица и другие символы, которые в доменах выдают за латиницу
+_CONFUSABLES = str.maketrans({
+    'а': 'a', 'в': 'b', 'с': 'c', 'ԁ': 'd', 'е': 'e', 'ё': 'e', 'һ': 'h', 'і': 'i', 'ј': 'j',
+    'к': 'k', 'ӏ': 'l', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p', 'ԛ': 'q', 'ѕ': 's', 'т': 't',
+    'у': 'y', 'х': 'x', 'ԝ': 'w', 'ɡ': 'g', 'ı': 'i', 'ο': 'o', 'α': 'a', 'ν': 'v',
+    '0': 'o', '1': 'l',
+})
+
+# Зоны, по которым домен без http:// в тексте считается ссылкой.
+# Короткий список: иначе за ссылки принимались бы обычные сокращения вроде "т.е."
+_TLDS = (
+    'com', 'net', 'org', 'info', 'biz', 'io', 'me', 'ru', 'su', 'by', 'ua', 'kz', 'uz', 'рф', 'бел',
+    'xyz', 'top', 'site', 'online', 'club', 'shop', 'store', 'app', 'dev', 'pro', 'link', 'live',
+    'click', 'space', 'tech', 'website', 'ly', 'gg', 'co', 'cc', 'ws', 'tk', 'ml', 'ga', 'cf', 'gq',
+    'to', 'tv', 'in', 'eu', 'de', 'us', 'uk',
+)
+# Точку в ссылках маскируют: "example[.]com", "example (dot) com"
+_DOT_OBFUSCATION = re.compile(r'\s*[\[(]\s*(?:\.|dot|точка)\s*[\])]\s*', re.IGNORECASE)
+_URL_IN_TEXT = re.compile(
+    r'(?:https?://|www\.)[^\s<>"«»]+'
+    r'|(?<![\w@.-])(?:[\w-]+\.)+(?:xn--[\w-]+|' + '|'.join(sorted(_TLDS, key=len, reverse=True)) + r')'
+    r'(?![\w-]|\.[\w-])(?:[/?#][^\s<>"«»]*)?',
+    re.IGNORECASE,
+)
+
+
+class HostInfo(NamedTuple):
+    """Нормализованный хост: ASCII-форма (punycode) и "скелет" для поиска подделок."""
+    ascii: str
+    skeleton: str
+
+
+@lru_cache(maxsize=4096)
+def normalize_host(host: str) -> Optional[HostInfo]:
+    """
+    Приводит хост к ASCII-форме (IDNA/punycode, нижний регистр, без точки в
+    конце) и строит скелет: punycode раскрывается, похожие на латиницу
+    символы заменяются латиницей. У "gооgle.com" с кириллическими "о" и у
+    "google.com" скелет один и тот же.
+    """
+    host = host.strip().strip('.').lower()
+    if not host:
+        return None
+    try:
+        ascii_host = host.encode('idna').decode('ascii')
+    except UnicodeError:
+        ascii_host = host
+    try:
+        unicode_host = ascii_host.encode('ascii').decode('idna')
+    except UnicodeError:
+        unicode_host = host
+    return HostInfo(ascii_host, unicode_host.translate(_CONFUSABLES))
+
+
+def url_host(url: str) -> Optional[HostInfo]:
+    """Хост ссылки (с протоколом или без) в нормализованном виде."""
+    try:
+        host = urlsplit(url if '//' in url else f'//{url}').hostname
+    except ValueError:
+        return None
+    return normalize_host(host) if host else None
+
+
+def extract_urls(text: str, entities: Dict = None) -> Iterator[str]:
+    """
+    Ссылки сообщения: из сущностей Telegram (url, text_link), если они переданы
+    (результат message.parse_entities), и из самого текста - в том числе те,
+    что Telegram не разметил, и с замаскированной точкой.
+    """
+    for entity, entity_text in (entities or {}).items():
+        yield entity.url if entity.type == 'text_link' else entity_text
+    if not text:
+        return
+    if '(' in text or '[' in text:
+        text = _DOT_OBFUSCATION.sub('.', text)
+    # Без точки в тексте нет и доменов, регулярное выражение можно не запускать
+    if '.' in text:
+        for match in _URL_IN_TEXT.finditer(text):
+            yield match.group().rstrip('.,;:!?)')
+
+
+class DomainTrie:
+    """
+    Суффиксное дерево доменов: метки хранятся от зоны к поддомену, правило
+    для домена действует и на все его поддомены, а самое длинное совпадение
+    побеждает (deny для ads.example.com при allow для example.com).
+    """
+
+    __slots__ = ('_root',)
+
+    def __init__(self, rules: Iterable[Tuple[str, str]] = ()):
+        # Узел: [дети по метке, вердикт или None]
+        self._root = [{}, None]
+        for domain, verdict in rules:
+            self.add(domain, verdict)
+
+    def add(self, domain: str, verdict: str):
+        node = self._root
+        for label in reversed(domain.split('.')):
+            node = node[0].setdefault(label, [{}, None])
+        node[1] = verdict
+
+    def lookup(self, host: str) -> Optional[str]:
+        node, verdict = self._root, None
+        for label in reversed(host.split('.')):
+            node = node[0].get(label)
+            if node is None:
+                break
+            if node[1] is not None:
+                verdict = node[1]
+        return verdict
+
+
+class LinkClassifier:
+    """
+    Проверка ссылок по спискам разрешенных и запрещенных доменов одного чата.
+
+    Хост сначала нормализуется (общий кэш normalize_host), затем ищется в
+    суффиксном дереве. Домен, скелет которого совпадает с разрешенным, но сам
+    он другой (кириллица вместо латиницы, xn--...), считается подделкой.
+    Вердикты запоминаются в ограниченном LRU, поэтому волна спама с одной
+    и той же ссылкой проверяется один раз.
+    """
+
+    def __init__(self, allow: Iterable[str] = (), deny: Iterable[str] = (), cache_size: int = 256):
+        allow = [h for h in map(normalize_host, allow) if h]
+        deny = [h for h in map(normalize_host, deny) if h]
+        self._rules = DomainTrie([(h.ascii, ALLOW) for h in allow] + [(h.ascii, DENY) for h in deny])
+        # Скелеты доменов, под которые может маскироваться подделка -> настоящий домен
+        protected = [normalize_host(d) for d in PROTECTED_DOMAINS]
+        self._skeletons = DomainTrie((h.skeleton, h.ascii) for h in allow + protected)
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self.cache_size = cache_size
+
+    def classify_host(self, host: HostInfo) -> str:
+        verdict = self._cache.get(host.ascii)
+        if verdict is not None:
+            self._cache.move_to_end(host.ascii)
+            return verdict
+        verdict = self._rules.lookup(host.ascii)
+        if verdict is None:
+            original = self._skeletons.lookup(host.skeleton)
+            if original and host.ascii != original and not host.ascii.endswith('.' + original):
+                verdict = LOOKALIKE
+            else:
+                verdict = UNKNOWN
+        self._cache[host.ascii] = verdict
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return verdict
+
+    def classify(self, url: str) -> str:
+        host = url_host(url)
+        return self.classify_host(host) if host else UNKNOWN
+
+    def first_blocked(self, urls: Iterable[str], block_unknown: bool) -> Optional[Tuple[str, str]]:
+        """
+        Первая ссылка, из-за которой сообщение надо удалить, и ее вердикт.
+        Запрещенные домены и подделки удаляются всегда, остальные незнакомые
+        ссылки - только если block_unknown.
+        """
+        for url in urls:
+            verdict = self.classify(url)
+            if verdict in (DENY, LOOKALIKE) or (verdict == UNKNOWN and block_unknown):
+                return url, verdict
+        return None
@@ -0,0 +1,156 @@
+from collections import deque
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+
+class Match(NamedTuple):
+    """Найденное стоп-слово и его позиция в тексте (срез text[start:end])."""
+    word: str
+    start: int
+    end: int
+
+
+class WordMatcher:
+    """
+    Автомат Ахо–Корасик для поиска стоп-слов.
+
+    Автомат строится один раз при загрузке списка, после чего проверка
+    сообщения - это один линейный проход по тексту, независимо от того,
+    сколько слов в списке.
+    """
+
+    __slots__ = ('_words', '_goto', '_fail', '_out', '_report')
+
+    def __init__(self, words: Iterable[str]):
+        # Сортируем, чтобы номера состояний не зависели от порядка в файле
+        self._words = tuple(sorted({w for w in words if w}))
+
+        # Бор: переходы по символам и индекс слова, которое заканчивается в состоянии
+        goto = [{}]
+        out = [-1]
+        for index, word in enumerate(self._words):
+            state = 0
+            for ch in word:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(-1)
+                state = nxt
+            out[state] = index
+
+        # Суффиксные ссылки (обход в ширину) и ссылки на ближайшее состояние со словом
+        fail = [0] * len(goto)
+        dict_link = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                target = goto[f].get(ch, 0)
+                fail[nxt] = target
+                dict_link[nxt] = target if out[target] >= 0 else dict_link[target]
+
+        # Для быстрого ответа "есть ли совпадение" храним в каждом состоянии
+        # самое длинное слово, которое в нем заканчивается (или -1)
+        report = [o if o >= 0 else (out[d] if d else -1) for o, d in zip(out, dict_link)]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = (out, dict_link)
+        self._report = report
+
+    def __len__(self) -> int:
+        return len(self._words)
+
+    @property
+    def words(self) -> tuple:
+        return self._words
+
+    def search(self, text: str) -> Optional[Match]:
+        """
+        Возвращает первое (по позиции окончания) найденное слово или None.
+        Из слов, заканчивающихся в одной позиции, выбирается самое длинное.
+        """
+        goto, fail, report = self._goto, self._fail, self._report
+        state = 0
+        for i, ch in enumerate(text):
+            while True:
+                nxt = goto[state].get(ch)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            index = report[state]
+            if index >= 0:
+                word = self._words[index]
+                return Match(word, i + 1 - len(word), i + 1)
+        return None
+
+    def finditer(self, text: str) -> Iterator[Match]:
+        """Перечисляет все вхождения стоп-слов (в том числе пересекающиеся)."""
+        goto, fail = self._goto, self._fail
+        out, dict_link = self._out
+        state = 0
+        for i, ch in enumerate(text):
+            while True:
+                nxt = goto[state].get(ch)
+                if nxt is not None:
+                    state = nxt
+                    break
+                if not state:
+                    break
+                state = fail[state]
+            s = state if out[state] >= 0 else dict_link[state]
+            while s:
+                word = self._words[out[s]]
+                yield Match(word, i + 1 - len(word), i + 1)
+                s = dict_link[s]
+
+
+class LayeredMatcher:
+    """
+    Стоп-слова отдельного чата поверх общего автомата.
+
+    Общий автомат не перестраивается: слова, разрешенные в чате, отбрасываются
+    при поиске, а собственные слова чата ищутся вторым, маленьким автоматом.
+    Поэтому правила чата компилируются за время, пропорциональное размеру его
+    собственных списков, а не всего общего списка.
+    """
+
+    __slots__ = ('base', 'extra', 'excluded')
+
+    def __init__(self, base: WordMatcher, extra: Iterable[str] = (), excluded: Iterable[str] = ()):
+        self.base = base
+        extra = frozenset(w for w in extra if w)
+        # Собственные слова чата важнее исключений
+        self.excluded = frozenset(excluded) - extra
+        self.extra = WordMatcher(extra) if extra else None
+
+    def __len__(self) -> int:
+        return len(self.words)
+
+    @property
+    def words(self) -> tuple:
+        words = {w for w in self.base.words if w not in self.excluded}
+        if self.extra is not None:
+            words.update(self.extra.words)
+        return tuple(sorted(words))
+
+    def search(self, text: str) -> Optional[Match]:
+        """То же, что WordMatcher.search, по объединенному списку."""
+        if self.excluded:
+            # finditer отдает совпадения по позиции окончания, в одной позиции - от длинного к короткому
+            match = next((m for m in self.base.finditer(text) if m.word not in self.excluded), None)
+        else:
+            match = self.base.search(text)
+        if self.extra is not None:
+            other = self.extra.search(text)
+            if other and (match is None or (other.end, other.start) < (match.end, match.start)):
+                match = other
+        return match
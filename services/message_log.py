@@ -0,0 +1,54 @@
+from collections import OrderedDict, deque
+from typing import Iterable, List, Optional, Tuple
+
+
+class MessageLog:
+    """
+    Последние сообщения одного чата для пакетных команд администраторов.
+
+    Хранит пары (message_id, автор) для max_messages последних проверенных
+    сообщений - по ним можно найти всех авторов диапазона сообщений, не
+    спрашивая Telegram. Отдельно помнит до max_messages пользователей,
+    которых спам-проверки уже отметили (например, участников рейда).
+    """
+
+    __slots__ = ('max_messages', '_messages', '_flagged')
+
+    def __init__(self, max_messages: int = 2000):
+        self.max_messages = max_messages
+        self._messages: deque = deque(maxlen=max_messages)
+        self._flagged: "OrderedDict[int, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(self, message_id: int, user_id: int):
+        self._messages.append((message_id, user_id))
+
+    def between(self, first_id: int, last_id: Optional[int] = None) -> List[Tuple[int, int]]:
+        """Сообщения (message_id, автор) с first_id по last_id включительно (без last_id - до конца)."""
+        return [
+            (message_id, user_id) for message_id, user_id in self._messages
+            if message_id >= first_id and (last_id is None or message_id <= last_id)
+        ]
+
+    def flag(self, user_ids: Iterable[int]):
+        for user_id in user_ids:
+            self._flagged[user_id] = None
+            self._flagged.move_to_end(user_id)
+        while len(self._flagged) > self.max_messages:
+            self._flagged.popitem(last=False)
+
+    def flagged(self) -> List[int]:
+        return list(self._flagged)
+
+    def clear_flagged(self):
+        self._flagged.clear()
+
+    def __getstate__(self):
+        return self.max_messages, list(self._messages), list(self._flagged)
+
+    def __setstate__(self, state):
+        self.max_messages, messages, flagged = state
+        self._messages = deque(map(tuple, messages), maxlen=self.max_messages)
+        self._flagged = OrderedDict.fromkeys(flagged)
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+from datetime import datetime, time
+from typing import Dict, Optional, Set, Tuple
+
+import pytz
+from telegram import ChatPermissions
+
+from services.outbound import OutboundQueue, TokenBucket
+from services.policy import ChatPolicy
+from services.storage import Storage
+
+# Последнее примененное к чату состояние: 'closed' (ночь) или 'open' (день)
+STATE_SETTING = 'night_state'
+CLOSED, OPEN = 'closed', 'open'
+
+CLOSED_PERMISSIONS = ChatPermissions(can_send_messages=False)
+# Обычные права участника: сообщения и любые медиа (can_send_media_messages
+# в Bot API разбит на отдельные права по типам)
+OPEN_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_audios=True,
+    can_send_documents=True,
+    can_send_photos=True,
+    can_send_videos=True,
+    can_send_video_notes=True,
+    can_send_voice_notes=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True
+)
+
+# Расписание: (часовой пояс, начало ночи, конец ночи)
+GroupKey = Tuple[str, str, str]
+
+
+def _parse(value: str) -> time:
+    hours, minutes = value.split(':')
+    return time(int(hours), int(minutes))
+
+
+def is_night(key: GroupKey, now: Optional[datetime] = None) -> bool:
+    """Идет ли сейчас ночь по расписанию key."""
+    timezone, start, end = key
+    current = (now or datetime.now(pytz.utc)).astimezone(pytz.timezone(timezone)).time().replace(tzinfo=None)
+    start, end = _parse(start), _parse(end)
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+class NightScheduler:
+    """
+    Планировщик ночного режима.
+
+    Чаты с одинаковым расписанием (часовой пояс, начало, конец) объединены
+    в группу, и на группу приходится две ежедневные задачи, а не две на чат.
+    Задача группы проходит по ее чатам не быстрее rate чатов в секунду,
+    а сами вызовы идут через очередь исходящих действий, поэтому тысячи
+    чатов не упираются в лимиты Telegram в 22:00.
+
+    Для каждого чата в хранилище записывается последнее примененное
+    состояние. При старте и раз в reconcile_interval секунд состояние
+    сверяется с расписанием, так что переходы, пропущенные во время
+    простоя бота, выполняются сразу после того, как restore() подключит
+    сохраненные чаты.
+    """
+
+    def __init__(self, storage: Storage, outbound: OutboundQueue, rate: float = 8.0,
+                 reconcile_interval: float = 60.0):
+        self.storage = storage
+        self.outbound = outbound
+        self.rate = rate
+        self.reconcile_interval = reconcile_interval
+        self._groups: Dict[GroupKey, Set[int]] = {}
+        self._chat_group: Dict[int, GroupKey] = {}
+        self._ends: Dict[int, str] = {}
+        self._state: Dict[int, str] = {}
+        self._runs: Dict[GroupKey, asyncio.Task] = {}
+        self._job_queue = None
+        self._bucket: Optional[TokenBucket] = None
+
+    # --- Запуск ---
+
+    def start(self, job_queue):
+        """
+        Подключает планировщик к job_queue. Чаты после этого можно добавлять
+        командами сразу, а сохраненные до перезапуска подключает restore().
+        """
+        self._job_queue = job_queue
+        self._bucket = TokenBucket(self.rate, 1)
+        job_queue.run_repeating(self._reconcile_job, interval=self.reconcile_interval,
+                                first=self.reconcile_interval, name='night_reconcile')
+
+    async def restore(self, chats: Dict[int, ChatPolicy]):
+        """Регистрирует сохраненные чаты и сразу догоняет переходы, пропущенные за время простоя."""
+        states = await self.storage.setting_values(STATE_SETTING)
+        for chat_id, policy in chats.items():
+            # Чат, который уже успели включить командой, не трогаем
+            if chat_id in self._chat_group:
+                continue
+            if chat_id in states:
+                self._state[chat_id] = states[chat_id]
+            self.add(chat_id, policy)
+        if self._groups:
+            logging.info(f"Ночной режим: {len(self._chat_group)} чатов в {len(self._groups)} расписаниях")
+        await self._reconcile_job(None)
+
+    async def stop(self):
+        tasks = list(self._runs.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._runs.clear()
+
+    # --- Чаты ---
+
+    def add(self, chat_id: int, policy: ChatPolicy):
+        """Включает ночной режим чата или переносит его в группу с новым расписанием."""
+        key = (policy.timezone, policy.night_start, policy.night_end)
+        old = self._chat_group.get(chat_id)
+        if old == key:
+            return
+        if old is not None:
+            self._leave(chat_id, old)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = set()
+            self._schedule(key)
+        group.add(chat_id)
+        self._chat_group[chat_id] = key
+        self._ends[chat_id] = policy.night_end
+
+    def remove(self, chat_id: int, forget: bool = False):
+        """
+        Убирает чат из планировщика. forget=True - еще и стирает его состояние
+        (ночной режим выключен); без него состояние остается для другого воркера.
+        """
+        key = self._chat_group.pop(chat_id, None)
+        if key is not None:
+            self._leave(chat_id, key)
+        self._ends.pop(chat_id, None)
+        self._state.pop(chat_id, None)
+        if forget:
+            self.storage.delete_chat_setting(chat_id, STATE_SETTING)
+
+    def _leave(self, chat_id: int, key: GroupKey):
+        group = self._groups[key]
+        group.discard(chat_id)
+        if not group:
+            del self._groups[key]
+            for job in self._job_queue.get_jobs_by_name(self._job_name(key, CLOSED)):
+                job.schedule_removal()
+            for job in self._job_queue.get_jobs_by_name(self._job_name(key, OPEN)):
+                job.schedule_removal()
+
+    async def sync_chat(self, chat_id: int):
+        """Сразу приводит чат в состояние, которое положено ему по расписанию сейчас."""
+        key = self._chat_group.get(chat_id)
+        if key is not None:
+            await self._apply(chat_id, CLOSED if is_night(key) else OPEN)
+
+    # --- Задачи ---
+
+    @staticmethod
+    def _job_name(key: GroupKey, state: str) -> str:
+        return f"night_{state}_{'_'.join(key)}"
+
+    def _schedule(self, key: GroupKey):
+        timezone, start, end = key
+        tz = pytz.timezone(timezone)
+        self._job_queue.run_daily(self._group_job, time=_parse(start).replace(tzinfo=tz),
+                                  data=(key, CLOSED), name=self._job_name(key, CLOSED))
+        self._job_queue.run_daily(self._group_job, time=_parse(end).replace(tzinfo=tz),
+                                  data=(key, OPEN), name=self._job_name(key, OPEN))
+
+    async def _group_job(self, context):
+        key, state = context.job.data
+        self._run(key, state)
+
+    async def _reconcile_job(self, context):
+        for key in list(self._groups):
+            state = CLOSED if is_night(key) else OPEN
+            run = self._runs.get(key)
+            if run is None and any(self._state.get(chat_id, OPEN) != state for chat_id in self._groups[key]):
+                self._run(key, state)
+
+    def _run(self, key: GroupKey, state: str):
+        # Новый переход группы отменяет незаконченный предыдущий
+        previous = self._runs.pop(key, None)
+        if previous is not None:
+            previous.cancel()
+        task = self._runs[key] = asyncio.create_task(self._run_group(key, state))
+        task.add_done_callback(lambda t: self._runs.pop(key, None) if self._runs.get(key) is t else None)
+
+    async def _run_group(self, key: GroupKey, state: str):
+        chats = sorted(self._groups.get(key, ()))
+        pending = [chat_id for chat_id in chats if self._state.get(chat_id, OPEN) != state]
+        if pending:
+            logging.info(f"Ночной режим ({', '.join(key)}): {state} для {len(pending)} чатов")
+        for chat_id in pending:
+            # Чат могли за это время убрать или перенести в другую группу
+            if self._chat_group.get(chat_id) == key:
+                await self._apply(chat_id, state)
+
+    async def _apply(self, chat_id: int, state: str):
+        if self._state.get(chat_id, OPEN) == state:
+            return
+        await self._bucket.acquire()
+        # Пока ждали своей очереди, чат могли уже перевести
+        if self._state.get(chat_id, OPEN) == state:
+            return
+        if state == CLOSED:
+            self.outbound.call(chat_id, 'set_chat_permissions', permissions=CLOSED_PERMISSIONS)
+            self.outbound.call(
+                chat_id, 'send_message',
+                text=f"🌙 Включаю ночной режим. Чат закрыт для сообщений до {self._ends.get(chat_id, '')}."
+            )
+        else:
+            self.outbound.call(chat_id, 'set_chat_permissions', permissions=OPEN_PERMISSIONS)
+            self.outbound.call(chat_id, 'send_message', text="☀️ Доброе утро! Чат снова открыт для общения.")
+        self._state[chat_id] = state
+        self.storage.set_chat_setting(chat_id, STATE_SETTING, state)
@@ -0,0 +1,79 @@
+import re
+import string
+from typing import Tuple
+
+# Латинские буквы, похожие на кириллические (и самые частые замены при обходе фильтра)
+_LOOKALIKES = {
+    'a': 'а', 'b': 'в', 'c': 'с', 'e': 'е', 'h': 'н', 'k': 'к', 'm': 'м',
+    'n': 'п', 'o': 'о', 'p': 'р', 'r': 'г', 't': 'т', 'u': 'и', 'x': 'х',
+    'y': 'у', 'z': 'з', 'ё': 'е', '@': 'а',
+}
+
+# Цифры, которыми заменяют буквы. Применяются только внутри слов,
+# чтобы обычные числа ("2000 рублей") не превращались в буквы.
+_DIGITS = {'0': 'о', '3': 'з', '4': 'ч', '6': 'б', '8': 'в'}
+
+# Невидимые символы, которые вставляют внутрь слов
+_ZERO_WIDTH = '\u00ad\u200b\u200c\u200d\u2060\ufeff'
+
+# Пунктуация, которой разбивают слова ("б.л.я", "х*й"). '@' здесь нет - это буква "а".
+_PUNCTUATION = (set(string.punctuation) | set('«»„“”‘’…–—·•')) - set(_LOOKALIKES)
+
+_STRIP = {ch: None for ch in _ZERO_WIDTH + ''.join(_PUNCTUATION)}
+_FOLD_TABLE = str.maketrans({**_LOOKALIKES, **_STRIP})
+_STRIP_TABLE = str.maketrans(_STRIP)
+_DIGIT_TABLE = str.maketrans(_DIGITS)
+
+_DIGITS_IN_WORD = re.compile(
+    rf'(?<=[^\W\d_])[{"".join(_DIGITS)}]+|[{"".join(_DIGITS)}]+(?=[^\W\d_])'
+)
+_REPEATS = re.compile(r'(.)\1+')
+# Растянутые буквы ("бляяя"): три и больше подряд. Двойные буквы бывают и в
+# обычном написании ("ссака", "масса"), их в стоп-словах не схлопываем
+_STRETCHED = re.compile(r'(.)\1{2,}')
+
+
+def _fold(text: str) -> str:
+    text = text.lower().translate(_FOLD_TABLE)
+    return _DIGITS_IN_WORD.sub(lambda m: m.group().translate(_DIGIT_TABLE), text)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Приводит текст к "скелету" для поиска стоп-слов: нижний регистр,
+    латинские двойники -> кириллица, цифры внутри слов -> буквы,
+    без невидимых символов и пунктуации, повторы букв схлопнуты.
+
+    По этому виду сравниваются сообщения при поиске рейдов; стоп-слова
+    ищутся по всем видам из text_forms.
+    """
+    return _REPEATS.sub(r'\1', _fold(text))
+
+
+def text_forms(text: str) -> Tuple[str, ...]:
+    """
+    Виды текста сообщения для поиска стоп-слов (без повторов):
+    скелет (normalize_text), он же без схлопывания повторов и просто
+    нижний регистр без пунктуации - для слов, которые normalize_word
+    оставляет с двойными буквами или латиницей.
+    """
+    folded = _fold(text)
+    forms = [_REPEATS.sub(r'\1', folded)]
+    for form in (folded, text.lower().translate(_STRIP_TABLE)):
+        if form not in forms:
+            forms.append(form)
+    return tuple(forms)
+
+
+def normalize_word(word: str) -> str:
+    """
+    Вид стоп-слова для поиска. Обычно это скелет, как у normalize_text, но:
+    - слово только из латиницы не переводится в кириллицу ("cock" стал бы
+      "соск" и находился бы в "соскучился") и ищется в тексте как есть;
+    - двойные буквы не схлопываются ("ссака" стала бы "сака" из "писака"),
+      такое слово ищется в тексте без схлопывания повторов.
+    """
+    lowered = word.lower()
+    if lowered.isascii() and any(ch.isalpha() for ch in lowered):
+        return lowered.translate(_STRIP_TABLE)
+    return _STRETCHED.sub(r'\1', _fold(word))
@@ -0,0 +1,225 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from datetime import timedelta
+from typing import Dict, Optional
+
+from telegram import Bot
+from telegram.error import RetryAfter, TelegramError
+
+# Telegram удаляет не больше 100 сообщений за один вызов delete_messages
+DELETE_BATCH_SIZE = 100
+MAX_ATTEMPTS = 3
+# Вызовы для отдельных участников: друг от друга не зависят, их можно слать параллельно
+CONCURRENT_METHODS = frozenset({'ban_chat_member', 'unban_chat_member', 'restrict_chat_member'})
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class TokenBucket:
+    """Ограничитель частоты: не больше rate вызовов в секунду с запасом burst."""
+
+    __slots__ = ('rate', 'burst', '_tokens', '_updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Забирает токен и возвращает, сколько секунд нужно подождать перед вызовом."""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self):
+        wait = self.delay()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class _ChatQueue:
+    """Накопленные действия одного чата."""
+
+    __slots__ = ('deletes', 'notices', 'notice_due', 'calls', 'sender', 'paused_until', 'task', 'wakeup')
+
+    def __init__(self, rate: float, burst: float):
+        self.deletes = []
+        self.notices = []
+        self.notice_due = 0.0
+        self.calls = deque()
+        self.sender = TokenBucket(rate, burst)
+        self.paused_until = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self.wakeup = asyncio.Event()
+
+    def __bool__(self) -> bool:
+        return bool(self.deletes or self.notices or self.calls)
+
+
+class OutboundQueue:
+    """
+    Очередь исходящих действий бота.
+
+    Обработчики только ставят действие в очередь и сразу возвращаются.
+    Для каждого чата с накопленными действиями работает своя задача:
+    удаления собираются в пачки для delete_messages, однотипные уведомления
+    за notice_window секунд склеиваются в одно сводное сообщение.
+    Подряд идущие баны и ограничения участников уходят параллельно, до
+    call_concurrency вызовов одновременно. Все вызовы проходят через общий
+    лимит global_rate в секунду, сообщения в чат - еще и через лимит
+    chat_rate; при RetryAfter чат ставится на паузу и вызов повторяется.
+    """
+
+    def __init__(self, flush_interval: float = 0.5, notice_window: float = 5.0,
+                 global_rate: float = 25.0, chat_rate: float = 20 / 60, chat_burst: float = 3,
+                 call_concurrency: int = 8):
+        self.flush_interval = flush_interval
+        self.notice_window = notice_window
+        self.call_concurrency = call_concurrency
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, _ChatQueue] = {}
+        self._bot: Optional[Bot] = None
+
+    def start(self, bot: Bot):
+        self._bot = bot
+
+    def set_global_rate(self, rate: float):
+        """Меняет общий лимит (воркеры шардированного режима делят его между собой)."""
+        self._global = TokenBucket(rate, rate)
+
+    async def stop(self):
+        """Дожидается отправки всего, что уже стоит в очереди."""
+        tasks = []
+        for queue in self._chats.values():
+            # Сводки отправляем сразу, не дожидаясь конца окна
+            queue.notice_due = 0.0
+            queue.wakeup.set()
+            if queue.task and not queue.task.done():
+                tasks.append(queue.task)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        self._bot = None
+
+    def pending(self) -> int:
+        return sum(len(q.deletes) + len(q.notices) + len(q.calls) for q in self._chats.values())
+
+    # --- Постановка в очередь ---
+
+    def delete(self, chat_id: int, message_id: int):
+        """Удалить сообщение (вместе с другими удалениями в этом чате)."""
+        queue = self._queue(chat_id)
+        queue.deletes.append(message_id)
+        self._wake(chat_id, queue)
+
+    def notice(self, chat_id: int, reason: str, text: str):
+        """
+        Отправить уведомление в чат. Если за notice_window секунд накопилось
+        несколько уведомлений, вместо них уходит одна сводка по причинам.
+        """
+        queue = self._queue(chat_id)
+        if not queue.notices:
+            queue.notice_due = time.monotonic() + self.notice_window
+        queue.notices.append((reason, text))
+        self._wake(chat_id, queue)
+
+    def call(self, chat_id: int, method: str, **kwargs):
+        """Вызвать метод Bot API (например, restrict_chat_member) с учетом лимитов."""
+        queue = self._queue(chat_id)
+        queue.calls.append((method, kwargs))
+        self._wake(chat_id, queue)
+
+    def _queue(self, chat_id: int) -> _ChatQueue:
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = _ChatQueue(self.chat_rate, self.chat_burst)
+        return queue
+
+    def _wake(self, chat_id: int, queue: _ChatQueue):
+        if self._bot is None:
+            raise RuntimeError("OutboundQueue не запущена: вызовите start(bot)")
+        queue.wakeup.set()
+        if queue.task is None or queue.task.done():
+            queue.task = asyncio.create_task(self._drain(chat_id, queue))
+
+    # --- Отправка ---
+
+    async def _drain(self, chat_id: int, queue: _ChatQueue):
+        try:
+            while queue:
+                # Даем накопиться пачке удалений
+                await asyncio.sleep(self.flush_interval)
+
+                while queue.calls:
+                    method, kwargs = queue.calls.popleft()
+                    if method not in CONCURRENT_METHODS:
+                        await self._send(chat_id, queue, method, {'chat_id': chat_id, **kwargs})
+                        continue
+                    # Пачка однотипных вызовов (например, баны после рейда) идет параллельно;
+                    # частоту по-прежнему ограничивает общий лимит в _send
+                    batch = [kwargs]
+                    while queue.calls and queue.calls[0][0] == method and len(batch) < self.call_concurrency:
+                        batch.append(queue.calls.popleft()[1])
+                    await asyncio.gather(*(
+                        self._send(chat_id, queue, method, {'chat_id': chat_id, **item}) for item in batch
+                    ))
+
+                while queue.deletes:
+                    batch = queue.deletes[:DELETE_BATCH_SIZE]
+                    del queue.deletes[:DELETE_BATCH_SIZE]
+                    if len(batch) == 1:
+                        await self._send(chat_id, queue, 'delete_message', {'chat_id': chat_id, 'message_id': batch[0]})
+                    else:
+                        await self._send(chat_id, queue, 'delete_messages', {'chat_id': chat_id, 'message_ids': batch})
+
+                if not queue.notices:
+                    continue
+                wait = queue.notice_due - time.monotonic()
+                if wait <= 0:
+                    notices, queue.notices = queue.notices, []
+                    await queue.sender.acquire()
+                    await self._send(chat_id, queue, 'send_message', {
+                        'chat_id': chat_id, 'text': self._merge(notices), 'disable_notification': True
+                    })
+                elif not queue.calls and not queue.deletes:
+                    # Ждем конца окна сводки или новых действий, что наступит раньше
+                    queue.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(queue.wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            if not queue:
+                self._chats.pop(chat_id, None)
+
+    async def _send(self, chat_id: int, queue: _ChatQueue, method: str, kwargs: dict):
+        for _ in range(MAX_ATTEMPTS):
+            pause = queue.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._global.acquire()
+            try:
+                return await getattr(self._bot, method)(**kwargs)
+            except RetryAfter as e:
+                logging.warning(f"Flood control в чате {chat_id}, пауза {e.retry_after} с.")
+                queue.paused_until = time.monotonic() + _seconds(e.retry_after)
+            except TelegramError as e:
+                logging.error(f"Не удалось выполнить {method} в чате {chat_id}: {e}")
+                return None
+        logging.error(f"{method} в чате {chat_id} не выполнен после {MAX_ATTEMPTS} попыток")
+        return None
+
+    def _merge(self, notices: list) -> str:
+        if len(notices) == 1:
+            return notices[0][1]
+        counts = Counter(reason for reason, _ in notices)
+        details = ", ".join(f"{reason} — {count}" for reason, count in counts.most_common())
+        return f"🛡 Модерация за последние {self.notice_window:g} сек.: {details}."
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from services.storage import Storage
+
+
+class StoragePersistence(BasePersistence):
+    """
+    Персистентность python-telegram-bot поверх Storage.
+
+    Сохраняется только chat_data (в нем живут окна спам-фильтра): PTB раз в
+    update_interval секунд передает изменившиеся chat_data, а Storage пишет их
+    пачкой в своем потоке.
+
+    При старте chat_data не загружается: чат читается из хранилища перед
+    первым обновлением или задачей этого чата (refresh_chat_data), поэтому
+    время запуска не зависит от числа чатов в базе. Отметки о прочитанных
+    чатах хранятся для cache_size последних активных чатов; чат, вытесненный
+    из них, при следующем обновлении дочитывает из хранилища только ключи,
+    которых нет в памяти.
+    """
+
+    def __init__(self, storage: Storage, update_interval: float = 60, cache_size: int = 10000):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=True, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.storage = storage
+        self.cache_size = cache_size
+        # Чаты, чьи chat_data уже прочитаны из хранилища (LRU)
+        self._loaded: "OrderedDict[int, None]" = OrderedDict()
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        if chat_id in self._loaded:
+            self._loaded.move_to_end(chat_id)
+            return
+        stored = await self.storage.load_chat(chat_id)
+        if chat_id in self._loaded:
+            # Пока шло чтение, чат загрузило другое обновление или задача
+            return
+        self._loaded[chat_id] = None
+        while len(self._loaded) > self.cache_size:
+            self._loaded.popitem(last=False)
+        for key, value in (stored or {}).items():
+            chat_data.setdefault(key, value)
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        self.storage.save_chat_data(chat_id, data)
+
+    async def drop_chat_data(self, chat_id: int):
+        self._loaded.pop(chat_id, None)
+        self.storage.delete_chat_data(chat_id)
+
+    async def flush(self):
+        await self.storage.flush()
+
+    # Остальные виды данных бот не хранит
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> Optional[tuple]:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]):
+        pass
+
+    async def update_user_data(self, user_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_user_data(self, user_id: int):
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
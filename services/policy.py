@@ -0,0 +1,207 @@
+import asyncio
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field, fields, replace
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple, Union
+
+from services.links import LinkClassifier
+from services.matcher import LayeredMatcher, WordMatcher
+from services.normalize import normalize_word
+from services.storage import Storage
+
+POLICY_SETTING = 'policy'
+
+
+@dataclass(frozen=True)
+class ChatPolicy:
+    """
+    Правила модерации одного чата. Объект неизменяемый: любое изменение
+    создает новую политику с увеличенным version.
+    """
+    spam_message_limit: int
+    spam_time_window_seconds: float
+    spam_mute_duration_hours: float
+    night_start: str
+    night_end: str
+    timezone: str
+    block_links: bool = True
+    # Дополнительные стоп-слова чата и слова, исключенные из общего списка
+    extra_words: FrozenSet[str] = field(default_factory=frozenset)
+    allowed_words: FrozenSet[str] = field(default_factory=frozenset)
+    # Домены, ссылки на которые разрешены (вместе с поддоменами)
+    link_allowlist: FrozenSet[str] = field(default_factory=frozenset)
+    # Домены, ссылки на которые удаляются всегда, даже если ссылки в чате разрешены
+    link_denylist: FrozenSet[str] = field(default_factory=frozenset)
+    # Одинаковое сообщение от стольких разных пользователей за окно - рейд (0 - выключено)
+    duplicate_min_users: int = 5
+    duplicate_window_seconds: float = 60
+    # Больше стольких входов за окно - наплыв (рейд) новых участников (0 - выключено)
+    join_raid_limit: int = 10
+    join_raid_window_seconds: float = 30
+    version: int = 0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        for name in ('extra_words', 'allowed_words', 'link_allowlist', 'link_denylist'):
+            data[name] = sorted(data[name])
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict, default: 'ChatPolicy') -> 'ChatPolicy':
+        known = {f.name for f in fields(cls)}
+        values = {k: (frozenset(v) if isinstance(v, list) else v) for k, v in data.items() if k in known}
+        return replace(default, **values)
+
+
+@dataclass(frozen=True)
+class CompiledPolicy:
+    """Политика вместе со всем, что нужно для проверки сообщений: читается целиком за раз."""
+    chat_id: int
+    policy: ChatPolicy
+    matcher: Union[WordMatcher, LayeredMatcher]
+    words_version: int
+    links: LinkClassifier
+
+
+class PolicyRegistry:
+    """
+    Реестр политик чатов.
+
+    Политики загружаются из хранилища при первом обращении. Скомпилированные
+    наборы (политика + автомат стоп-слов) лежат в LRU с ключом
+    (chat_id, версия политики, версия общего списка слов). Новая политика
+    сначала полностью компилируется и только потом подменяет старую одной
+    операцией, поэтому обработчик никогда не видит частично обновленные правила.
+    """
+
+    def __init__(self, storage: Storage, default: ChatPolicy, cache_size: int = 1000):
+        self.storage = storage
+        self.default = default
+        self.cache_size = cache_size
+        self.words_version = 0
+        self._base_words: FrozenSet[str] = frozenset()
+        self._base_matcher = WordMatcher(())
+        # Стоп-слова чатов из файлов (services.wordlist), уже нормализованные
+        self._chat_words: Dict[int, FrozenSet[str]] = {}
+        self._policies: "OrderedDict[int, ChatPolicy]" = OrderedDict()
+        self._compiled: "OrderedDict[Tuple[int, int, int], CompiledPolicy]" = OrderedDict()
+        # Первая загрузка общего списка, которую надо дождаться (см. WordLists.load_in_background)
+        self._words_pending: Optional[asyncio.Future] = None
+
+    @property
+    def base_words(self) -> FrozenSet[str]:
+        return self._base_words
+
+    def set_base_words(self, words: Iterable[str], matcher: Optional[WordMatcher] = None):
+        """Подменяет общий список стоп-слов; все чаты перекомпилируются при следующем обращении."""
+        words = frozenset(words)
+        self._base_matcher = matcher if matcher is not None else WordMatcher(words)
+        self._base_words = words
+        self.words_version += 1
+        self._compiled.clear()
+
+    def set_chat_words(self, chat_id: int, words: Optional[Iterable[str]]):
+        """Задает стоп-слова чата из файла (None - файла больше нет)."""
+        if words:
+            self._chat_words[chat_id] = frozenset(words)
+        elif self._chat_words.pop(chat_id, None) is None:
+            return
+        # Набор чата перекомпилируется при следующем сообщении
+        for key in [key for key in self._compiled if key[0] == chat_id]:
+            del self._compiled[key]
+
+    def wait_for_words(self, loading: Optional[asyncio.Future]):
+        """Общий список еще загружается: get() не отдаст правила, пока загрузка не закончится."""
+        self._words_pending = loading
+
+    def chats_with_words(self) -> List[int]:
+        return list(self._chat_words)
+
+    def chat_words(self, chat_id: int) -> Optional[FrozenSet[str]]:
+        return self._chat_words.get(chat_id)
+
+    async def get_policy(self, chat_id: int) -> ChatPolicy:
+        policy = self._policies.get(chat_id)
+        if policy is not None:
+            self._policies.move_to_end(chat_id)
+            return policy
+        settings = await self.storage.get_chat_settings(chat_id)
+        # Пока шла загрузка, политику могли уже изменить
+        policy = self._policies.get(chat_id)
+        if policy is None:
+            data = settings.get(POLICY_SETTING)
+            policy = ChatPolicy.from_dict(data, self.default) if data else self.default
+            self._remember(chat_id, policy)
+        return policy
+
+    async def get(self, chat_id: int) -> CompiledPolicy:
+        """Скомпилированная политика чата (основной вызов на горячем пути)."""
+        if self._words_pending is not None:
+            if not self._words_pending.done():
+                # shield: отмена одного обработчика не должна отменять общую загрузку
+                await asyncio.shield(self._words_pending)
+            self._words_pending = None
+        policy = await self.get_policy(chat_id)
+        key = (chat_id, policy.version, self.words_version)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            compiled = self.compile(chat_id, policy)
+            self._cache(key, compiled)
+        else:
+            self._compiled.move_to_end(key)
+        return compiled
+
+    async def update(self, chat_id: int, **changes) -> CompiledPolicy:
+        """Меняет политику чата и атомарно публикует перекомпилированный набор."""
+        old = await self.get_policy(chat_id)
+        new = replace(old, version=old.version + 1, **changes)
+        compiled = self._publish(chat_id, old, new)
+        self.storage.set_chat_setting(chat_id, POLICY_SETTING, new.to_dict())
+        return compiled
+
+    async def reset(self, chat_id: int) -> CompiledPolicy:
+        """Возвращает чату общие правила из config."""
+        old = await self.get_policy(chat_id)
+        compiled = self._publish(chat_id, old, replace(self.default, version=old.version + 1))
+        self.storage.delete_chat_setting(chat_id, POLICY_SETTING)
+        return compiled
+
+    def _publish(self, chat_id: int, old: ChatPolicy, new: ChatPolicy) -> CompiledPolicy:
+        compiled = self.compile(chat_id, new)
+        # Публикация: после этих строк все новые сообщения видят новую политику
+        self._remember(chat_id, new)
+        self._compiled.pop((chat_id, old.version, self.words_version), None)
+        self._cache((chat_id, new.version, self.words_version), compiled)
+        return compiled
+
+    def compile(self, chat_id: int, policy: ChatPolicy,
+                file_words: Optional[FrozenSet[str]] = None) -> CompiledPolicy:
+        """
+        Компилирует политику, не публикуя ее. file_words - стоп-слова чата из
+        файла, если их надо взять не из этого реестра (см. services.rules).
+        """
+        if file_words is None:
+            file_words = self._chat_words.get(chat_id)
+        if policy.extra_words or policy.allowed_words or file_words:
+            extra = {normalize_word(w) for w in policy.extra_words} | (file_words or frozenset())
+            allowed = {normalize_word(w) for w in policy.allowed_words}
+            # Общий автомат не перестраивается, поверх него ищутся только слова чата
+            matcher = LayeredMatcher(self._base_matcher, extra, allowed)
+        else:
+            # Чаты без своих слов делят общий автомат
+            matcher = self._base_matcher
+        links = LinkClassifier(policy.link_allowlist, policy.link_denylist)
+        return CompiledPolicy(chat_id, policy, matcher, self.words_version, links)
+
+    def _remember(self, chat_id: int, policy: ChatPolicy):
+        self._policies[chat_id] = policy
+        self._policies.move_to_end(chat_id)
+        while len(self._policies) > self.cache_size:
+            self._policies.popitem(last=False)
+
+    def _cache(self, key: tuple, compiled: CompiledPolicy):
+        self._compiled[key] = compiled
+        while len(self._compiled) > self.cache_size:
+            self._compiled.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {'policies': len(self._policies), 'compiled': len(self._compiled), 'words_version': self.words_version}
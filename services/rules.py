@@ -0,0 +1,76 @@
+import json
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+from services.matcher import WordMatcher
+from services.policy import ChatPolicy, CompiledPolicy, PolicyRegistry
+from services.wordlist import build_word_list
+
+
+class RuleSet:
+    """
+    Версия правил для оценки без действий: общий список стоп-слов и поправки
+    к политике чата (поля ChatPolicy, например {"spam_message_limit": 4}).
+
+    Используется офлайн (scorer.py) и в теневом режиме (config.shadow_rules):
+    политика чата берется действующая, поправки накладываются поверх, а
+    скомпилированные наборы хранятся в своем LRU. Состояние спам-фильтров
+    для правил-кандидатов тоже свое (state), чтобы не портить рабочее.
+    """
+
+    def __init__(self, name: str, words: Iterable[str], overrides: Dict = None, cache_size: int = 1000,
+                 matcher: Optional[WordMatcher] = None):
+        self.name = name
+        self.overrides = dict(overrides or {})
+        self.cache_size = cache_size
+        words = frozenset(words)
+        # Общий автомат; готовый передают, чтобы не строить его повторно (см. scorer.py)
+        self.matcher = matcher if matcher is not None else WordMatcher(words)
+        # Реестр без хранилища: из него нужен только общий автомат и compile()
+        self._registry = PolicyRegistry(None, None, cache_size)
+        self._registry.set_base_words(words, self.matcher)
+        self._compiled: "OrderedDict[Tuple, CompiledPolicy]" = OrderedDict()
+        self._states: "OrderedDict[int, dict]" = OrderedDict()
+
+    @classmethod
+    def load(cls, name: str, words_path: str, policy_path: Optional[str] = None,
+             cache_size: int = 1000, cache_dir: Optional[str] = None) -> 'RuleSet':
+        """
+        Читает список стоп-слов (как stopwords.txt) и поправки к политике из JSON.
+        cache_dir - каталог готовых автоматов, как у build_word_list.
+        """
+        _, words, matcher = build_word_list(words_path, cache_dir)
+        overrides = {}
+        if policy_path:
+            with open(policy_path, 'r', encoding='utf-8') as f:
+                overrides = json.load(f)
+        return cls(name, words, overrides, cache_size, matcher)
+
+    @property
+    def words(self) -> FrozenSet[str]:
+        return self._registry.base_words
+
+    def compiled(self, chat_id: int, policy: ChatPolicy,
+                 file_words: Optional[FrozenSet[str]] = None) -> CompiledPolicy:
+        """Политика чата с поправками этой версии правил, скомпилированная по ее словам."""
+        key = (chat_id, policy.version, file_words)
+        compiled = self._compiled.get(key)
+        if compiled is not None:
+            self._compiled.move_to_end(key)
+            return compiled
+        candidate = ChatPolicy.from_dict(self.overrides, policy) if self.overrides else policy
+        compiled = self._compiled[key] = self._registry.compile(chat_id, candidate, file_words)
+        while len(self._compiled) > self.cache_size:
+            self._compiled.popitem(last=False)
+        return compiled
+
+    def state(self, chat_id: int) -> dict:
+        """Состояние спам-фильтров чата для этой версии правил (аналог chat_data)."""
+        state = self._states.get(chat_id)
+        if state is None:
+            state = self._states[chat_id] = {}
+            while len(self._states) > self.cache_size:
+                self._states.popitem(last=False)
+        else:
+            self._states.move_to_end(chat_id)
+        return state
@@ -0,0 +1,60 @@
+import bisect
+import hashlib
+from typing import Iterable, List, Optional
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Консистентное хеширование чатов по воркерам.
+
+    Каждый воркер представлен на кольце replicas виртуальными точками.
+    Чат принадлежит первому воркеру по часовой стрелке от хеша chat_id,
+    поэтому при добавлении воркера к нему переезжает лишь примерно 1/N
+    чатов, а остальные остаются на своих местах.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 128):
+        self.replicas = replicas
+        self._nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def add(self, node: str):
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        for i in range(self.replicas):
+            point = _hash(f'{node}#{i}')
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: str):
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        keep = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in keep]
+        self._owners = [o for _, o in keep]
+
+    def node_for(self, key: Optional[int]) -> str:
+        """Воркер для ключа (chat_id). Обновления без чата всегда идут на один и тот же воркер."""
+        if not self._points:
+            raise LookupError("На кольце нет ни одного воркера")
+        if key is None:
+            return self._owners[0]
+        index = bisect.bisect(self._points, _hash(str(key)))
+        return self._owners[index % len(self._owners)]
@@ -0,0 +1,271 @@
+import asyncio
+import json
+import logging
+import pickle
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Set
+
+
+class Storage(ABC):
+    """
+    Хранилище состояния бота: настройки чатов (ночной режим и т.п.)
+    и chat_data обработчиков (окна спам-фильтра).
+
+    Запись не блокирует обработчики: set_*/save_* только ставят изменение
+    в очередь, на диск оно попадает пачкой при следующем flush().
+    """
+
+    @abstractmethod
+    async def get_chat_settings(self, chat_id: int) -> Dict[str, Any]:
+        """Настройки чата; загружаются при первом обращении."""
+
+    @abstractmethod
+    async def chats_with_setting(self, key: str) -> Set[int]:
+        """Все чаты, у которых задана настройка key."""
+
+    @abstractmethod
+    async def setting_values(self, key: str) -> Dict[int, Any]:
+        """Значения настройки key у всех чатов, где она задана."""
+
+    @abstractmethod
+    def set_chat_setting(self, chat_id: int, key: str, value: Any):
+        """Сохраняет настройку (значение должно сериализоваться в JSON)."""
+
+    @abstractmethod
+    def delete_chat_setting(self, chat_id: int, key: str):
+        """Удаляет настройку чата."""
+
+    @abstractmethod
+    async def load_chat(self, chat_id: int) -> Optional[dict]:
+        """chat_data одного чата (None, если ничего не сохранено); PTB-персистентность читает его лениво."""
+
+    @abstractmethod
+    def save_chat_data(self, chat_id: int, data: dict):
+        """Сохраняет chat_data чата."""
+
+    @abstractmethod
+    def delete_chat_data(self, chat_id: int):
+        """Удаляет chat_data чата."""
+
+    @abstractmethod
+    async def flush(self):
+        """Записывает все накопленные изменения."""
+
+    @abstractmethod
+    async def close(self):
+        """Записывает изменения и освобождает ресурсы."""
+
+
+class SQLiteStorage(Storage):
+    """
+    Хранилище на SQLite в режиме WAL.
+
+    Все обращения к базе идут через один рабочий поток, поэтому event loop
+    не ждет диска. Изменения копятся в памяти (последняя запись по ключу
+    побеждает) и раз в flush_interval секунд пишутся одной транзакцией.
+    Настройки чатов читаются лениво и держатся в LRU на cache_size чатов.
+
+    Одну базу могут открыть несколько процессов (шардированный запуск):
+    запись, заставшая базу занятой, ждет до busy_timeout секунд, а пачка,
+    которую так и не удалось записать, остается в очереди до следующей попытки.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS chat_settings ("
+        " chat_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+        " PRIMARY KEY (chat_id, key)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS chat_settings_key ON chat_settings (key)",
+        "CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL)",
+    )
+
+    def __init__(self, path: str, flush_interval: float = 5.0, cache_size: int = 10000,
+                 busy_timeout: float = 30.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.busy_timeout = busy_timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        self._conn: Optional[sqlite3.Connection] = None
+        self._settings: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        # Отложенные записи: ключ -> значение (None означает удаление)
+        self._settings_writes: Dict[tuple, Optional[str]] = {}
+        self._data_writes: Dict[int, Optional[bytes]] = {}
+        self._flushing_settings: Dict[tuple, Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # --- Работа с базой (только в рабочем потоке) ---
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # timeout - сколько ждать, пока другой процесс держит блокировку записи
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        return self._connect().execute(sql, params).fetchall()
+
+    def _write(self, settings: Dict[tuple, Optional[str]], data: Dict[int, Optional[bytes]]):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO chat_settings (chat_id, key, value) VALUES (?, ?, ?) "
+                "ON CONFLICT (chat_id, key) DO UPDATE SET value = excluded.value",
+                [(chat_id, key, value) for (chat_id, key), value in settings.items() if value is not None]
+            )
+            conn.executemany(
+                "DELETE FROM chat_settings WHERE chat_id = ? AND key = ?",
+                [key for key, value in settings.items() if value is None]
+            )
+            conn.executemany(
+                "INSERT INTO chat_data (chat_id, data) VALUES (?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET data = excluded.data",
+                [(chat_id, blob) for chat_id, blob in data.items() if blob is not None]
+            )
+            conn.executemany(
+                "DELETE FROM chat_data WHERE chat_id = ?",
+                [(chat_id,) for chat_id, blob in data.items() if blob is None]
+            )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # --- Настройки чатов ---
+
+    async def get_chat_settings(self, chat_id: int) -> Dict[str, Any]:
+        settings = self._settings.get(chat_id)
+        if settings is None:
+            rows = await self._run(self._query, "SELECT key, value FROM chat_settings WHERE chat_id = ?", (chat_id,))
+            # Пока шел запрос, настройки могли уже загрузить или изменить
+            settings = self._settings.get(chat_id)
+            if settings is None:
+                settings = {key: json.loads(value) for key, value in rows}
+                # Учитываем еще не записанные изменения
+                for (pending_chat, key), value in self._pending_settings():
+                    if pending_chat == chat_id:
+                        if value is None:
+                            settings.pop(key, None)
+                        else:
+                            settings[key] = json.loads(value)
+                self._remember(chat_id, settings)
+        else:
+            self._settings.move_to_end(chat_id)
+        return settings
+
+    async def chats_with_setting(self, key: str) -> Set[int]:
+        rows = await self._run(self._query, "SELECT chat_id FROM chat_settings WHERE key = ?", (key,))
+        chats = {chat_id for chat_id, in rows}
+        # Учитываем еще не записанные изменения
+        for (chat_id, pending_key), value in self._pending_settings():
+            if pending_key == key:
+                (chats.add if value is not None else chats.discard)(chat_id)
+        return chats
+
+    async def setting_values(self, key: str) -> Dict[int, Any]:
+        rows = await self._run(self._query, "SELECT chat_id, value FROM chat_settings WHERE key = ?", (key,))
+        values = {chat_id: json.loads(value) for chat_id, value in rows}
+        # Учитываем еще не записанные изменения
+        for (chat_id, pending_key), value in self._pending_settings():
+            if pending_key == key:
+                if value is None:
+                    values.pop(chat_id, None)
+                else:
+                    values[chat_id] = json.loads(value)
+        return values
+
+    def set_chat_setting(self, chat_id: int, key: str, value: Any):
+        settings = self._settings.get(chat_id)
+        if settings is not None:
+            settings[key] = value
+        self._settings_writes[(chat_id, key)] = json.dumps(value, ensure_ascii=False)
+        self._schedule_flush()
+
+    def delete_chat_setting(self, chat_id: int, key: str):
+        settings = self._settings.get(chat_id)
+        if settings is not None:
+            settings.pop(key, None)
+        self._settings_writes[(chat_id, key)] = None
+        self._schedule_flush()
+
+    def _pending_settings(self):
+        """Изменения настроек, которых еще нет в базе (в том числе записываемые прямо сейчас)."""
+        yield from self._flushing_settings.items()
+        yield from self._settings_writes.items()
+
+    def _remember(self, chat_id: int, settings: Dict[str, Any]):
+        self._settings[chat_id] = settings
+        while len(self._settings) > self.cache_size:
+            self._settings.popitem(last=False)
+
+    # --- chat_data ---
+
+    async def load_chat(self, chat_id: int) -> Optional[dict]:
+        if chat_id in self._data_writes:
+            # Еще не записанное изменение новее того, что лежит в базе
+            blob = self._data_writes[chat_id]
+        else:
+            rows = await self._run(self._query, "SELECT data FROM chat_data WHERE chat_id = ?", (chat_id,))
+            blob = rows[0][0] if rows else None
+        if blob is None:
+            return None
+        try:
+            return pickle.loads(blob)
+        except Exception as e:
+            logging.error(f"Не удалось загрузить chat_data чата {chat_id}: {e}")
+            return None
+
+    def save_chat_data(self, chat_id: int, data: dict):
+        self._data_writes[chat_id] = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        self._schedule_flush()
+
+    def delete_chat_data(self, chat_id: int):
+        self._data_writes[chat_id] = None
+        self._schedule_flush()
+
+    # --- Запись ---
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        # Повторяем, пока в очереди что-то есть: и пачку, вернувшуюся после
+        # ошибки записи, и изменения, пришедшие, пока шла запись
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self._settings_writes and not self._data_writes:
+                return
+
+    async def flush(self):
+        if not self._settings_writes and not self._data_writes:
+            return
+        settings, self._settings_writes = self._settings_writes, {}
+        data, self._data_writes = self._data_writes, {}
+        self._flushing_settings = settings
+        try:
+            await self._run(self._write, settings, data)
+        except Exception as e:
+            logging.error(f"Не удалось записать состояние в {self.path}: {e}")
+            # Возвращаем изменения в очередь, более новые значения важнее
+            self._settings_writes = {**settings, **self._settings_writes}
+            self._data_writes = {**data, **self._data_writes}
+        finally:
+            self._flushing_settings = {}
+
+    async def close(self):
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,60 @@
+import asyncio
+from typing import Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def chat_key(update: object) -> Optional[int]:
+    """Ключ, по которому упорядочиваются и распределяются обновления: чат, иначе пользователь."""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Параллельная обработка обновлений с сохранением порядка внутри чата.
+
+    Обновления разных чатов обрабатываются одновременно (не больше
+    max_concurrent_updates за раз), а обновления одного чата - строго по
+    очереди, в порядке поступления. Обновления, ждущие своей очереди в чате,
+    не занимают слоты параллельности, поэтому один шумный чат не тормозит
+    остальные; общее число принятых в работу обновлений ограничено max_pending.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending: Optional[int] = None):
+        super().__init__(max_pending or max_concurrent_updates * 16)
+        self._active = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chat_id -> (замок чата, сколько обновлений его держат или ждут)
+        self._chats: Dict[int, list] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        key = chat_key(update)
+        if key is None:
+            async with self._active:
+                await coroutine
+            return
+
+        entry = self._chats.get(key)
+        if entry is None:
+            entry = self._chats[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._active:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,356 @@
+import asyncio
+import ctypes
+import ctypes.util
+import hashlib
+import inspect
+import logging
+import os
+import pickle
+import re
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, FrozenSet, Optional, Set, Tuple
+
+from services.matcher import WordMatcher
+from services.normalize import normalize_text, normalize_word
+from services.policy import PolicyRegistry
+
+# Файл со стоп-словами отдельного чата: <chat_id>.txt
+CHAT_FILE_RE = re.compile(r'^(-?\d+)\.txt$')
+
+
+class WordListError(Exception):
+    """Новый список стоп-слов не удалось загрузить; продолжает действовать старый."""
+
+
+def read_word_file(path: str) -> Tuple[int, FrozenSet[str]]:
+    """
+    Читает файл со словами (по одному в строке) и нормализует их
+    (см. services.normalize.normalize_word). Варианты написания, которые после нормализации
+    совпали, остаются одним словом. Возвращает (строк в файле, слова).
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        raw_words = {line.strip() for line in f if line.strip()}
+    words = {normalize_word(word) for word in raw_words}
+    words.discard('')
+    return len(raw_words), frozenset(words)
+
+
+def _code_fingerprint() -> bytes:
+    """Версия кода нормализации и автомата: при их изменении готовые автоматы устаревают."""
+    digest = hashlib.sha256()
+    for source in (normalize_text, WordMatcher):
+        with open(inspect.getfile(source), 'rb') as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+def build_word_list(path: str, cache_dir: Optional[str] = None) -> Tuple[int, FrozenSet[str], WordMatcher]:
+    """
+    Читает общий список и строит по нему автомат. Выполняется вне event loop.
+
+    С cache_dir готовый автомат сохраняется в файл, ключ которого - хеш
+    содержимого списка и кода нормализации и автомата. Пока список не меняется, при
+    следующих запусках автомат читается из файла, а не строится заново.
+    """
+    if not cache_dir:
+        raw_count, words = read_word_file(path)
+        return raw_count, words, WordMatcher(words)
+    with open(path, 'rb') as f:
+        content = f.read()
+    key = hashlib.sha256(_code_fingerprint() + content).hexdigest()[:16]
+    prefix = os.path.splitext(os.path.basename(path))[0] + '-'
+    artifact = os.path.join(cache_dir, f'{prefix}{key}.pickle')
+    try:
+        with open(artifact, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Не удалось прочитать готовый автомат {artifact}, он будет построен заново: {e}")
+
+    raw_count, words = read_word_file(path)
+    result = raw_count, words, WordMatcher(words)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Запись через временный файл: другой процесс не прочитает его недописанным
+        tmp = f'{artifact}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, artifact)
+        # Автоматы прежних версий этого списка больше не понадобятся
+        stale = re.compile(re.escape(prefix) + r'[0-9a-f]{16}\.pickle')
+        for name in os.listdir(cache_dir):
+            if stale.fullmatch(name) and name != os.path.basename(artifact):
+                os.remove(os.path.join(cache_dir, name))
+    except OSError as e:
+        logging.warning(f"Не удалось сохранить автомат стоп-слов в {cache_dir}: {e}")
+    return result
+
+
+class _Inotify:
+    """Изменения файлов в каталогах через inotify (Linux), без сторонних библиотек."""
+
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_FROM = 0x040
+    IN_MOVED_TO = 0x080
+    IN_DELETE = 0x200
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._directories: Dict[int, str] = {}
+        for directory in directories:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, f"inotify_add_watch {directory}")
+            self._directories[wd] = directory
+
+    def read(self) -> Set[str]:
+        """Пути файлов, изменившихся с прошлого чтения."""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+        paths = set()
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self._directories and name:
+                paths.add(os.path.join(self._directories[wd], os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WordLists:
+    """
+    Общий список стоп-слов и списки отдельных чатов из файлов.
+
+    Файлы отслеживаются в фоне (inotify, а где его нет - опрос времени
+    изменения). Новый автомат собирается в отдельном потоке и подменяет
+    старый одной операцией в реестре политик; если файл не читается или
+    автомат не собрался, продолжает действовать предыдущая версия списка.
+    """
+
+    def __init__(self, policies: PolicyRegistry, base_path: str, chat_dir: str,
+                 poll_interval: float = 5.0, debounce: float = 0.5, cache_dir: Optional[str] = None):
+        self.policies = policies
+        self.base_path = base_path
+        self.chat_dir = chat_dir
+        # Каталог для готовых автоматов (см. build_word_list); None - строить всегда
+        self.cache_dir = cache_dir
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        # Номер версии общего списка, который сейчас действует
+        self.version = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='wordlist')
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loading: Optional[asyncio.Future] = None
+
+    # --- Загрузка ---
+
+    def load_in_background(self):
+        """
+        Первая загрузка при старте: списки читаются в отдельном потоке, и бот
+        принимает обновления сразу, независимо от размера списка. Пока загрузка
+        идет, policies.get() ждет ее, так что ни одно сообщение не проверится
+        без общего списка.
+        """
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load_async())
+            self.policies.wait_for_words(self._loading)
+
+    async def wait_loaded(self):
+        """Дожидается первой загрузки, запущенной load_in_background."""
+        if self._loading is not None:
+            await asyncio.shield(self._loading)
+
+    async def _load_async(self):
+        started = time.perf_counter()
+        try:
+            async with self._get_lock():
+                loaded = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_all)
+                self._publish_all(*loaded)
+        except Exception as e:
+            logging.error(f"Не удалось загрузить {self.base_path}, общий список стоп-слов пуст: {e}")
+        else:
+            logging.info(f"Стоп-слова загружены за {time.perf_counter() - started:.2f} с")
+
+    def _read_all(self):
+        """Чтение всех списков; выполняется вне event loop."""
+        try:
+            base = build_word_list(self.base_path, self.cache_dir)
+        except FileNotFoundError:
+            logging.warning(f"Файл {self.base_path} не найден, список стоп-слов пуст.")
+            base = 0, frozenset(), None
+        chats = {}
+        for chat_id, path in self._chat_files().items():
+            try:
+                chats[chat_id] = read_word_file(path)[1]
+            except (OSError, UnicodeDecodeError) as e:
+                logging.error(f"Не удалось прочитать стоп-слова чата {chat_id} из {path}: {e}")
+        return base, chats
+
+    def _publish_all(self, base, chats: Dict[int, FrozenSet[str]]) -> int:
+        raw_count, words, matcher = base
+        self._publish_base(raw_count, words, matcher)
+        for chat_id, chat_words in chats.items():
+            self.policies.set_chat_words(chat_id, chat_words)
+        return len(words)
+
+    async def reload(self) -> int:
+        """
+        Перечитывает общий список и списки чатов, не блокируя обработку сообщений.
+        Если общий список не загрузился, бросает WordListError (старый список остается).
+        """
+        count = await self.reload_base()
+        chat_files = self._chat_files()
+        for chat_id in set(chat_files) | set(self.policies.chats_with_words()):
+            await self.reload_chat(chat_id, chat_files.get(chat_id))
+        return count
+
+    async def reload_base(self) -> int:
+        async with self._get_lock():
+            try:
+                raw_count, words, matcher = await asyncio.get_running_loop().run_in_executor(
+                    self._executor, build_word_list, self.base_path, self.cache_dir
+                )
+            except Exception as e:
+                logging.error(f"Не удалось загрузить {self.base_path}, действует версия {self.version}: {e}")
+                raise WordListError(str(e)) from e
+            self._publish_base(raw_count, words, matcher)
+            return len(words)
+
+    async def reload_chat(self, chat_id: int, path: Optional[str]):
+        """Обновляет список чата из файла; path=None - файл удален."""
+        if path is None or not os.path.exists(path):
+            self.policies.set_chat_words(chat_id, None)
+            return
+        try:
+            _, words = await asyncio.get_running_loop().run_in_executor(self._executor, read_word_file, path)
+        except (OSError, UnicodeDecodeError) as e:
+            logging.error(f"Не удалось прочитать стоп-слова чата {chat_id} из {path}: {e}")
+            return
+        self.policies.set_chat_words(chat_id, words)
+        logging.info(f"Стоп-слова чата {chat_id} обновлены: {len(words)}")
+
+    def _publish_base(self, raw_count: int, words: FrozenSet[str], matcher: Optional[WordMatcher]):
+        # Подмена одной операцией: сообщения проверяются либо старым, либо новым автоматом
+        self.policies.set_base_words(words, matcher)
+        self.version += 1
+        if len(words) < raw_count:
+            logging.info(f"Стоп-слова: {raw_count} в файле, {len(words)} после нормализации.")
+        logging.info(f"Загружен список стоп-слов версии {self.version}: {len(words)} слов")
+
+    def _chat_files(self) -> Dict[int, str]:
+        try:
+            names = os.listdir(self.chat_dir)
+        except FileNotFoundError:
+            return {}
+        files = {}
+        for name in names:
+            match = CHAT_FILE_RE.match(name)
+            if match:
+                files[int(match.group(1))] = os.path.join(self.chat_dir, name)
+        return files
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    # --- Отслеживание файлов ---
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def _apply(self, paths: Set[str]):
+        for path in paths:
+            if os.path.abspath(path) == os.path.abspath(self.base_path):
+                try:
+                    await self.reload_base()
+                except WordListError:
+                    pass
+            elif os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.chat_dir):
+                match = CHAT_FILE_RE.match(os.path.basename(path))
+                if match:
+                    await self.reload_chat(int(match.group(1)), path)
+
+    async def _watch(self):
+        directories = {os.path.dirname(os.path.abspath(self.base_path))}
+        if os.path.isdir(self.chat_dir):
+            directories.add(os.path.abspath(self.chat_dir))
+        try:
+            inotify = _Inotify(directories)
+        except (OSError, AttributeError) as e:
+            logging.info(f"inotify недоступен ({e}), изменения стоп-слов проверяются раз в {self.poll_interval:g} с.")
+            await self._poll()
+            return
+
+        loop = asyncio.get_running_loop()
+        changed: Set[str] = set()
+        event = asyncio.Event()
+
+        def on_readable():
+            changed.update(inotify.read())
+            if changed:
+                event.set()
+
+        loop.add_reader(inotify.fd, on_readable)
+        try:
+            while True:
+                await event.wait()
+                # Редакторы сохраняют файл в несколько шагов, ждем, пока все закончится
+                await asyncio.sleep(self.debounce)
+                event.clear()
+                paths = set(changed)
+                changed.clear()
+                await self._apply(paths)
+        finally:
+            loop.remove_reader(inotify.fd)
+            inotify.close()
+
+    def _snapshot(self) -> Dict[str, Tuple[float, int]]:
+        paths = [self.base_path, *self._chat_files().values()]
+        snapshot = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            snapshot[path] = (stat.st_mtime, stat.st_size)
+        return snapshot
+
+    async def _poll(self):
+        snapshot = self._snapshot()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            current = self._snapshot()
+            changed = {p for p in current.keys() | snapshot.keys() if current.get(p) != snapshot.get(p)}
+            snapshot = current
+            if changed:
+                await self._apply(changed)
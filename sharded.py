@@ -0,0 +1,236 @@
+"""
+Шардированный запуск бота: один процесс-маршрутизатор и N процессов-воркеров.
+
+Маршрутизатор только получает обновления (polling или webhook) и по chat_id
+отправляет каждое своему воркеру через консистентное хеш-кольцо. Воркер -
+обычное приложение из main.build_application без Updater: все обработчики,
+спам-фильтр, кэши и политики работают как раньше, но только для своих чатов,
+поэтому состояние чата живет в одном процессе и не требует блокировок.
+
+Воркер добавляется сигналом SIGUSR1 маршрутизатору. Перед этим старые воркеры
+дообрабатывают очередь и сбрасывают состояние в базу, а новый стартует уже
+после этого и видит актуальные данные переехавших к нему чатов.
+"""
+import asyncio
+import logging
+import multiprocessing
+import queue
+import secrets
+import signal
+from typing import Dict, List
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+import config
+from services.sharding import HashRing
+from services.update_processor import chat_key
+
+# Сколько ждать, пока старые воркеры отпустят переезжающие чаты
+REBALANCE_TIMEOUT_SECONDS = 30
+# Как часто проверять, что воркеры живы
+WORKER_CHECK_SECONDS = 5
+
+
+# --- Воркер ---
+
+def _worker_main(name: str, nodes: List[str], updates, acks):
+    # Ctrl+C получает вся группа процессов; воркер останавливает маршрутизатор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve_worker(name, nodes, updates, acks))
+
+
+def _apply_ring(application, name: str, nodes: List[str]):
+    """Запоминает новый состав воркеров и отдает ночной режим переехавших чатов."""
+    ring = HashRing(nodes)
+    config.bot_state.owner = lambda chat_id: ring.node_for(chat_id) == name
+    config.outbound.set_global_rate(config.API_GLOBAL_RATE / len(ring))
+    if application is not None:
+        for chat_id in config.bot_state.night_mode_chats:
+            if not config.bot_state.owns(chat_id):
+                config.night_scheduler.remove(chat_id)
+
+
+async def _serve_worker(name: str, nodes: List[str], updates, acks):
+    import main
+
+    _apply_ring(None, name, nodes)
+    if config.METRICS_PORT:
+        # У каждого воркера свои метрики и свой порт
+        config.metrics_server.port = config.METRICS_PORT + int(name.rsplit('-', 1)[1]) + 1
+    application = main.build_application(main.default_builder().updater(None))
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    logging.info(f"Воркер {name} запущен")
+
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # Ждем в отдельном потоке, а все, что уже пришло, забираем без ожидания
+            messages = [await loop.run_in_executor(None, updates.get)]
+            while messages[-1] is not None:
+                try:
+                    messages.append(updates.get_nowait())
+                except queue.Empty:
+                    break
+            for message in messages:
+                if message is None:
+                    return
+                kind, payload = message
+                if kind == 'update':
+                    await application.update_queue.put(Update.de_json(payload, application.bot))
+                elif kind == 'ring':
+                    nodes, epoch = payload
+                    # Дообрабатываем уже принятое и сохраняем состояние для нового владельца
+                    await application.update_queue.join()
+                    _apply_ring(application, name, nodes)
+                    await application.update_persistence()
+                    await config.storage.flush()
+                    acks.put((name, epoch))
+    finally:
+        await application.update_queue.join()
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        await application.post_shutdown(application)
+        logging.info(f"Воркер {name} остановлен")
+
+
+# --- Маршрутизатор ---
+
+class ShardRouter:
+    """Распределяет обновления по воркерам и следит за их составом."""
+
+    def __init__(self):
+        self.ring = HashRing()
+        self._mp = multiprocessing.get_context('spawn')
+        self._queues: Dict[str, multiprocessing.Queue] = {}
+        self._processes: Dict[str, multiprocessing.Process] = {}
+        self._acks = self._mp.Queue()
+        self._epoch = 0
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._stopping = False
+
+    def _spawn(self, name: str):
+        process = self._mp.Process(
+            target=_worker_main,
+            args=(name, self.ring.nodes, self._queues[name], self._acks),
+            name=f'moderator-{name}',
+        )
+        process.start()
+        self._processes[name] = process
+
+    def start(self, workers: int):
+        for i in range(workers):
+            name = f'worker-{i}'
+            self.ring.add(name)
+            self._queues[name] = self._mp.Queue()
+        for name in self.ring.nodes:
+            self._spawn(name)
+        logging.info(f"Запущено воркеров: {workers}")
+
+    def route(self, update: Update):
+        name = self.ring.node_for(chat_key(update))
+        self._queues[name].put(('update', update.to_dict()))
+
+    async def add_worker(self):
+        """Добавляет воркер; к нему переезжает примерно 1/N чатов."""
+        if not self._ready.is_set():
+            return
+        self._ready.clear()
+        try:
+            name = f'worker-{len(self._queues)}'
+            nodes = self.ring.nodes + [name]
+            self._epoch += 1
+            for worker_queue in self._queues.values():
+                worker_queue.put(('ring', (nodes, self._epoch)))
+            await self._wait_acks(set(self._queues), self._epoch)
+            self.ring.add(name)
+            self._queues[name] = self._mp.Queue()
+            self._spawn(name)
+            logging.info(f"Добавлен воркер {name}, всего воркеров: {len(self.ring)}")
+        finally:
+            self._ready.set()
+
+    async def _wait_acks(self, waiting: set, epoch: int):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + REBALANCE_TIMEOUT_SECONDS
+        while waiting and loop.time() < deadline:
+            try:
+                name, acked = await loop.run_in_executor(None, self._acks.get, True, 1.0)
+            except queue.Empty:
+                continue
+            if acked == epoch:
+                waiting.discard(name)
+        if waiting:
+            logging.warning(f"Воркеры не подтвердили перебалансировку вовремя: {', '.join(sorted(waiting))}")
+
+    async def watch(self):
+        """Перезапускает упавшие воркеры; их очереди сохраняются, и ждущие обновления не теряются."""
+        while not self._stopping:
+            await asyncio.sleep(WORKER_CHECK_SECONDS)
+            for name, process in list(self._processes.items()):
+                if not self._stopping and not process.is_alive():
+                    logging.error(f"Воркер {name} завершился с кодом {process.exitcode}, перезапускаю")
+                    self._spawn(name)
+
+    async def dispatch(self, updates: asyncio.Queue):
+        while True:
+            update = await updates.get()
+            # Во время перебалансировки обновления ждут у маршрутизатора
+            await self._ready.wait()
+            self.route(update)
+
+    def stop(self):
+        self._stopping = True
+        for worker_queue in self._queues.values():
+            worker_queue.put(None)
+        for process in self._processes.values():
+            process.join()
+
+
+async def _serve_front(workers: int):
+    router = ShardRouter()
+    router.start(workers)
+
+    update_queue = asyncio.Queue()
+    updater = Updater(Bot(config.BOT_TOKEN), update_queue)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, lambda: asyncio.ensure_future(router.add_worker()))
+
+    tasks = [asyncio.create_task(router.dispatch(update_queue)), asyncio.create_task(router.watch())]
+    try:
+        async with updater:
+            if config.BOT_MODE == 'webhook':
+                if not config.WEBHOOK_URL:
+                    raise SystemExit("Для BOT_MODE=webhook нужно задать WEBHOOK_URL")
+                await updater.start_webhook(
+                    listen=config.WEBHOOK_LISTEN,
+                    port=config.WEBHOOK_PORT,
+                    url_path=config.WEBHOOK_PATH,
+                    webhook_url=f"{config.WEBHOOK_URL.rstrip('/')}/{config.WEBHOOK_PATH}",
+                    secret_token=config.WEBHOOK_SECRET or secrets.token_urlsafe(32),
+                    allowed_updates=Update.ALL_TYPES,
+                )
+            else:
+                await updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            await stop.wait()
+            await updater.stop()
+    finally:
+        for task in tasks:
+            task.cancel()
+        # То, что уже получено, отдаем воркерам до остановки
+        while not update_queue.empty():
+            router.route(update_queue.get_nowait())
+        router.stop()
+
+
+def run(workers: int):
+    print(f"Бот запущен в шардированном режиме, воркеров: {workers}...")
+    asyncio.run(_serve_front(workers))